@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import time
+import os
+from os import path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from libs.read_input import GeneralParams, parse_param_value
+from libs.scheduler import SchedulerExecutor
+from cluster_imfit import fit, make_executor
+
+# Manifest columns before the parameter overrides
+manifestColumns = ["name", "model", "image", "PSF", "mask", "weight"]
+# Overridable parameters which are file names
+fileParams = ["initSeedFile"]
+
+
+def resolve(fileName, baseDir):
+    """ Makes a file name of the manifest relative to the manifest directory """
+    if fileName == "none":
+        return fileName
+    return path.abspath(path.join(baseDir, fileName))
+
+
+def read_manifest(fileName, defaults):
+    """ Reads the manifest of the batch. Every line describes an object:
+
+        name  model  image  psf  mask  weight  [param=value ...]
+
+    'none' stands for absent psf, mask or weight, the optional param=value
+    pairs override the parameters of the config for this object. File
+    names are relative to the manifest directory. Returns the list of
+    (name, modelFileName, overrides) tuples. """
+    baseDir = path.dirname(path.abspath(fileName))
+    objects = []
+    names = set()
+    for lineNumber, line in enumerate(open(fileName), start=1):
+        sLine = line.strip()
+        if "#" in sLine:
+            # Drop the comment part of the line if exists
+            sLine = sLine[:sLine.index("#")].strip()
+        if len(sLine) == 0:
+            continue
+        columns = sLine.split()
+        if len(columns) < len(manifestColumns):
+            raise ValueError("%s:%i: expected at least %i columns (%s)" % (fileName, lineNumber,
+                                                                          len(manifestColumns),
+                                                                          " ".join(manifestColumns)))
+        name = columns[0]
+        if name in names:
+            raise ValueError("%s:%i: duplicate object name '%s'" % (fileName, lineNumber, name))
+        names.add(name)
+        overrides = {"fitsToFit": resolve(columns[2], baseDir),
+                     "PSF": resolve(columns[3], baseDir),
+                     "mask": resolve(columns[4], baseDir),
+                     "weight": resolve(columns[5], baseDir)}
+        for pair in columns[len(manifestColumns):]:
+            if "=" not in pair:
+                raise ValueError("%s:%i: override '%s' is not in the param=value form" % (fileName, lineNumber,
+                                                                                           pair))
+            key, value = pair.split("=", 1)
+            if key not in defaults:
+                raise ValueError("%s:%i: unknown parameter '%s'" % (fileName, lineNumber, key))
+            value = parse_param_value(defaults[key], value)
+            if key in fileParams:
+                value = resolve(value, baseDir)
+            overrides[key] = value
+        objects.append((name, resolve(columns[1], baseDir), overrides))
+    return objects
+
+
+def fit_object(name, modelFileName, params, outDir, pool, cores, resume=False):
+    """ Fits one object of the batch in the outDir/name directory.
+    Returns the status of the fit, its chi squared and the time spent """
+    objectDir = path.join(outDir, name)
+    if not os.path.exists(objectDir):
+        os.makedirs(objectDir)
+    logFile = open(path.join(objectDir, "log.dat"), "a", buffering=1)
+    logFile.write("\n\n\n################################\n")
+    logFile.write("Object %s, model %s, image %s\n" % (name, modelFileName, params.fitsToFit))
+    startTime = time.time()
+    try:
+        chisq = fit(modelFileName, params, executor=pool, resultsDir=path.join(objectDir, "results"),
+                    logFile=logFile, cores=cores, resume=resume).chisq
+        status = "done"
+    except Exception as err:
+        # a failed object must not stop the others
+        logFile.write("\n%s. Aborting...\n" % err)
+        chisq = float("nan")
+        status = "failed"
+    logFile.close()
+    return status, chisq, time.time() - startTime
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit many objects with one pool of imfit workers")
+    parser.add_argument("manifest", help="File with 'name model image psf mask weight [param=value ...]' lines")
+    parser.add_argument("config", help="Config file with parameters shared by all the objects")
+    parser.add_argument("--outdir", default="batch", help="Directory for the results of the objects")
+    parser.add_argument("--concurrent", type=int, default=0,
+                        help="Number of objects fitted at once (default: numOfCores // 4)")
+    parser.add_argument("--whole-fits", dest="wholeFits", action="store_true",
+                        help="Submit every fit as a task of the batch scheduler (schedSubmit etc. in the config)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the interrupted fits from their checkpoints")
+    args = parser.parse_args()
+
+    defaults = GeneralParams(args.config).params
+    objects = read_manifest(args.manifest, defaults)
+    numOfCores = defaults["numOfCores"]
+    concurrent = args.concurrent or max(1, numOfCores // 4)
+    concurrent = min(concurrent, len(objects))
+    # every object gets an equal share of the pool
+    cores = max(1, numOfCores // concurrent)
+    # the fits can run on other nodes
+    args.outdir = path.abspath(args.outdir)
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+    summary = open(path.join(args.outdir, "summary.dat"), "a", buffering=1)
+    summary.write("# Batch %s started at %s\n" % (args.manifest, datetime.datetime.now().strftime("%d.%m.%Y %H:%M")))
+    summary.write("# name  status  chi2  time(s)\n")
+    if args.wholeFits:
+        # every node fits one object with a pool of numOfCores processes
+        pool = None
+        cores = None
+        executor = SchedulerExecutor(defaults["schedSubmit"], defaults["schedStatus"], defaults["schedCancel"],
+                                     defaults["schedTaskVar"], defaults["schedSpool"], groupSize=1,
+                                     lostChecks=defaults["schedLostChecks"])
+        print("Fitting %i objects as tasks of the batch scheduler" % len(objects))
+    else:
+        pool = make_executor(argparse.Namespace(**defaults))
+        executor = ThreadPoolExecutor(max_workers=concurrent)
+        print("Fitting %i objects, %i at once with %i cores each" % (len(objects), concurrent, cores))
+
+    startTime = time.time()
+    with executor:
+        futures = {}
+        for name, modelFileName, overrides in objects:
+            params = argparse.Namespace(**defaults)
+            for key, value in overrides.items():
+                setattr(params, key, value)
+            if args.wholeFits:
+                params.executor = "pool"
+            futures[executor.submit(fit_object, name, modelFileName, params, args.outdir, pool, cores,
+                                    args.resume)] = name
+        numFailed = 0
+        for future in as_completed(futures):
+            name = futures[future]
+            status, chisq, timeSpent = future.result()
+            numFailed += (status != "done")
+            summary.write("%s  %s  %1.5f  %1.1f\n" % (name, status, chisq, timeSpent))
+            print("%s: %s (chi2=%1.5f, %1.1f s)" % (name, status, chisq, timeSpent))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    totalTimeString = time.strftime("%Hh:%Mm:%Ss", time.gmtime(time.time() - startTime))
+    print("%i objects fitted (%i failed) in %s" % (len(objects), numFailed, totalTimeString))
+    summary.write("# %i objects fitted (%i failed) in %s\n" % (len(objects), numFailed, totalTimeString))
+    summary.close()
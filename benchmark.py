@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import tempfile
+import time
+from math import sqrt
+from random import randrange
+
+import numpy as np
+
+from libs.read_input import ImfitModel
+from libs.pygene.organism import MendelOrganism
+from libs.pygene.arraypop import ArrayPopulation
+from libs.pygene.strategies import CMAESPopulation, DEPopulation
+from libs.pygene.selection import operators, selectPairs
+
+
+# Model of a synthetic galaxy: bulge + disk. The true values of the
+# parameters are the ones given in the file, the GA has to find them
+# within the given limits.
+SYNTHETIC_MODEL = """
+X0   40.5   30,50
+Y0   39.5   30,50
+FUNCTION Sersic
+PA     35.0    0,180
+ell    0.2     0,0.7
+n      2.5     0.5,6
+I_e    20.0    1,500
+r_e    4.0     0.5,30
+X0   40.5   30,50
+Y0   39.5   30,50
+FUNCTION Exponential
+PA     60.0    0,180
+ell    0.5     0,0.8
+I_0    15.0    0.5,300
+h      12.0    1,50
+"""
+
+
+def render_model(model, shape):
+    """ Renders Sersic and Exponential functions of an ImfitModel
+    to an image (imfit conventions: 1-based pixel coordinates, PA is
+    counted counter-clockwise from the +y axis)"""
+    y, x = np.indices(shape) + 1.0
+    image = np.zeros(shape)
+    for func in model.listOfFunctions:
+        p = dict((par.name, par.value) for par in func.params)
+        theta = np.radians(p["PA"])
+        dx = x - p["X0"]
+        dy = y - p["Y0"]
+        major = -dx * np.sin(theta) + dy * np.cos(theta)
+        minor = -dx * np.cos(theta) - dy * np.sin(theta)
+        r = np.hypot(major, minor / (1.0 - p["ell"]))
+        if func.name == "Sersic":
+            n = p["n"]
+            bn = 2 * n - 1.0 / 3 + 4.0 / (405 * n)
+            image += p["I_e"] * np.exp(-bn * ((r / p["r_e"]) ** (1.0 / n) - 1))
+        elif func.name == "Exponential":
+            image += p["I_0"] * np.exp(-r / p["h"])
+        else:
+            raise ValueError("Function %s is not supported by the renderer" % func.name)
+    return image
+
+
+def synthetic_species(rng, shape=(80, 80), sigma=1.0, encoding="linear"):
+    """ Creates a synthetic galaxy image with noise and an organism class
+    whose fitness is the reduced chi squared of the model computed
+    in-process. The class counts its fitness evaluations in
+    the 'evaluations' attribute """
+    fd, modelFileName = tempfile.mkstemp(suffix=".imfit")
+    with os.fdopen(fd, "w") as fout:
+        fout.write(SYNTHETIC_MODEL)
+    model = ImfitModel(modelFileName, quiet=True, encoding=encoding)
+    os.remove(modelFileName)
+    image = render_model(model, shape) + rng.normal(scale=sigma, size=shape)
+    genome = model.create_genome()
+    dof = image.size - len(genome)
+
+    class SyntheticGalaxy(MendelOrganism):
+        evaluations = 0
+
+        def fitness(self):
+            SyntheticGalaxy.evaluations += 1
+            self.model.genome_to_model(dict((key, self[key]) for key in self.genes.keys()))
+            return np.sum(((image - render_model(self.model, shape)) / sigma) ** 2) / dof
+
+    SyntheticGalaxy.model = model
+    SyntheticGalaxy.genome = genome
+    return SyntheticGalaxy
+
+
+def old_select_pairs(nadults, npairs):
+    """ Parent selection loop of the classic Population.gen """
+    n2adults = nadults * nadults
+    pairs = []
+    for i in range(npairs):
+        idx1 = idx2 = int(sqrt(randrange(n2adults)))
+        while idx2 == idx1:
+            idx2 = int(sqrt(randrange(n2adults)))
+        pairs.append((-idx1 % nadults, -idx2 % nadults))
+    return pairs
+
+
+def takeover_time(operator, pressure, popSize, rng, maxGens=1000):
+    """ Number of generations of pure selection (no crossover and mutation)
+    needed for the best organism to fill the whole population """
+    fitnesses = np.sort(rng.random(popSize))
+    bestValue = fitnesses[0]
+    for gen in range(1, maxGens):
+        idx1, idx2 = selectPairs(fitnesses, popSize // 2, rng, operator, pressure)
+        fitnesses = np.sort(fitnesses[np.concatenate((idx1, idx2))])
+        if np.all(fitnesses == bestValue):
+            return gen
+    return maxGens
+
+
+def bench_selection(args):
+    rng = np.random.default_rng(args.seed)
+    print("Selection operators: population %i, %i parent pairs, %i trials\n" % (args.popsize, args.pairs,
+                                                                                   args.trials))
+    print("%-12s %10s %10s %10s %10s %10s" % ("operator", "bestCopies", "intensity", "lossOfDiv",
+                                              "takeover", "time, ms"))
+    for name in operators:
+        bestCopies = []
+        intensity = []
+        lossOfDiversity = []
+        for trial in range(args.trials):
+            fitnesses = np.sort(rng.normal(size=args.popsize))
+            idx1, idx2 = selectPairs(fitnesses, args.pairs, rng, name, args.pressure)
+            chosen = np.concatenate((idx1, idx2))
+            # expected number of copies of the best organism per population size draws
+            bestCopies.append(np.sum(chosen == 0) * args.popsize / float(len(chosen)))
+            # selection intensity: how much the selected parents are better than average
+            intensity.append((fitnesses.mean() - fitnesses[chosen].mean()) / fitnesses.std())
+            lossOfDiversity.append(1.0 - len(np.unique(chosen)) / float(args.popsize))
+        takeover = np.mean([takeover_time(name, args.pressure, args.popsize, rng) for i in range(10)])
+        t1 = time.time()
+        for trial in range(args.trials):
+            selectPairs(fitnesses, args.pairs, rng, name, args.pressure)
+        dt = (time.time() - t1) * 1000 / args.trials
+        print("%-12s %10.3f %10.3f %10.3f %10.1f %10.4f" % (name, np.mean(bestCopies), np.mean(intensity),
+                                                           np.mean(lossOfDiversity), takeover, dt))
+    t1 = time.time()
+    for trial in range(args.trials):
+        old_select_pairs(args.popsize, args.pairs)
+    dt = (time.time() - t1) * 1000 / args.trials
+    print("%-12s %10s %10s %10s %10s %10.4f" % ("old loop", "-", "-", "-", "-", dt))
+
+
+def evaluations_to_target(species, target, maxEvals, popClass=ArrayPopulation, **popParams):
+    """ Runs the optimiser until the best organism reaches the target fitness.
+    Returns the number of fitness evaluations spent (or None if the target
+    was not reached within maxEvals evaluations) and the best fitness. """
+    species.evaluations = 0
+    pop = popClass(species=species, **popParams)
+    while species.evaluations < maxEvals:
+        best = pop.best().get_fitness()
+        if best <= target:
+            return species.evaluations, best
+        pop.gen()
+    return None, pop.best().get_fitness()
+
+
+def bench_operators(args):
+    rng = np.random.default_rng(args.seed)
+    variants = [("mendel", "float", ArrayPopulation), ("mendel", "polynomial", ArrayPopulation),
+                ("sbx", "polynomial", ArrayPopulation), ("blx", "polynomial", ArrayPopulation),
+                ("block", "polynomial", ArrayPopulation),
+                ("sbx", "float", ArrayPopulation), ("cmaes", "-", CMAESPopulation), ("de", "-", DEPopulation)]
+    galaxies = [synthetic_species(rng) for i in range(args.galaxies)]
+    print("\nEvaluations to reach reduced chi^2 <= %1.3f (%i galaxies, %i runs each, limit %i evaluations)\n" % (
+        args.target, args.galaxies, args.runs, args.maxevals))
+    print("%-12s %-12s %10s %10s %10s" % ("crossover", "mutation", "median", "reached", "best chi2"))
+    for crossover, mutation, popClass in variants:
+        evaluations = []
+        bestFitness = []
+        operatorParams = {}
+        if popClass is ArrayPopulation:
+            operatorParams = {"crossover": crossover, "mutation": mutation}
+        for species in galaxies:
+            for run in range(args.runs):
+                evals, best = evaluations_to_target(species, args.target, args.maxevals, popClass,
+                                                    init=args.zerogen, childCount=args.popsize,
+                                                    childCull=args.selectnbest, numNewOrganisms=args.addnew,
+                                                    seed=rng.integers(2**31), **operatorParams)
+                evaluations.append(args.maxevals if evals is None else evals)
+                bestFitness.append(best)
+        reached = np.sum(np.array(evaluations) < args.maxevals)
+        print("%-12s %-12s %10i %6i/%-3i %10.4f" % (crossover, mutation, np.median(evaluations),
+                                                   reached, len(evaluations), np.median(bestFitness)))
+
+
+def bench_encodings(args):
+    rng = np.random.default_rng(args.seed)
+    print("\nEvaluations to reach reduced chi^2 <= %1.3f (%i galaxies, %i runs each, limit %i evaluations)\n" % (
+        args.target, args.galaxies, args.runs, args.maxevals))
+    print("%-12s %10s %10s %10s" % ("encoding", "median", "reached", "best chi2"))
+    seeds = rng.integers(2**31, size=args.galaxies)
+    for encoding in ("linear", "auto"):
+        evaluations = []
+        bestFitness = []
+        runRng = np.random.default_rng(args.seed)
+        for galaxySeed in seeds:
+            # the same galaxies for all the encodings
+            species = synthetic_species(np.random.default_rng(galaxySeed), encoding=encoding)
+            for run in range(args.runs):
+                evals, best = evaluations_to_target(species, args.target, args.maxevals,
+                                                    init=args.zerogen, childCount=args.popsize,
+                                                    childCull=args.selectnbest, numNewOrganisms=args.addnew,
+                                                    seed=runRng.integers(2**31))
+                evaluations.append(args.maxevals if evals is None else evals)
+                bestFitness.append(best)
+        reached = np.sum(np.array(evaluations) < args.maxevals)
+        print("%-12s %10i %6i/%-3i %10.4f" % (encoding, np.median(evaluations), reached, len(evaluations),
+                                             np.median(bestFitness)))
+
+
+def add_ga_arguments(parser):
+    """ GA parameters for benchmarks running the whole optimisation """
+    parser.add_argument("--zerogen", type=int, default=300,
+                        help="Size of random zero generation")
+    parser.add_argument("--popsize", type=int, default=100,
+                        help="Size of i-th generation")
+    parser.add_argument("--selectnbest", type=int, default=50,
+                        help="Number of best organisms selected in the generation")
+    parser.add_argument("--addnew", type=int, default=10,
+                        help="Number of random organisms added in each generation")
+    parser.add_argument("--galaxies", type=int, default=3,
+                        help="Number of synthetic galaxies")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Number of GA runs per galaxy")
+    parser.add_argument("--target", type=float, default=1.5,
+                        help="Target reduced chi squared")
+    parser.add_argument("--maxevals", type=int, default=10000,
+                        help="Maximal number of fitness evaluations per run")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the random number generator")
+    subparsers = parser.add_subparsers(dest="bench")
+    subparsers.required = True
+    selParser = subparsers.add_parser("selection", help="Compare selection pressure of the selection operators")
+    selParser.add_argument("--popsize", type=int, default=50,
+                           help="Number of adults to select from")
+    selParser.add_argument("--pairs", type=int, default=100,
+                           help="Number of parent pairs to draw")
+    selParser.add_argument("--pressure", type=float, default=2.0,
+                           help="Selection pressure parameter")
+    selParser.add_argument("--trials", type=int, default=200,
+                           help="Number of repetitions")
+    selParser.set_defaults(func=bench_selection)
+    opParser = subparsers.add_parser("operators", help="Compare crossover and mutation operators on synthetic galaxies")
+    add_ga_arguments(opParser)
+    opParser.set_defaults(func=bench_operators)
+    encParser = subparsers.add_parser("encodings", help="Compare gene encodings on synthetic galaxies")
+    add_ga_arguments(encParser)
+    encParser.set_defaults(func=bench_encodings)
+    args = parser.parse_args()
+    args.func(args)
@@ -9,14 +9,29 @@ from os import path
 from os import getcwd
 from multiprocessing import Pool
 import subprocess
+import signal
+import re
 from shutil import move
 import uuid
+import threading
 
-from numpy import argmin, isnan
+from numpy import argmin, isnan, nan, array_split, arange, array, savez, load
+from numpy.random import default_rng
 
-from libs.read_input import ImfitModel, GeneralParams
+from libs.read_input import ImfitModel, GeneralParams, read_seed_file
+from libs.bootstrap import merge_bootstrap_files, save_bootstrap_summary
+from libs.scheduler import SchedulerExecutor
 from libs.pygene.organism import MendelOrganism
-from libs.pygene.population import Population
+from libs.pygene.arraypop import ArrayPopulation
+from libs.pygene.strategies import CMAESPopulation, DEPopulation
+
+# LM iteration lines of imfit output ("mpfit iteration 3: fit statistic = 1234.5 ...")
+fitProgressRe = re.compile(r"iteration\s+\d+\s*:\s*fit statistic\s*=\s*([-+0-9.eE]+)")
+
+# Population classes for the 'optimizer' config parameter
+optimizers = {"ga": ArrayPopulation,
+              "cmaes": CMAESPopulation,
+              "de": DEPopulation}
 
 
 def remove(pth):
@@ -24,69 +39,423 @@ def remove(pth):
         os.remove(pth)
 
 
-def run_imfit_parallel(runString, fname=None):
+class FitResult(object):
+    """ Result of a fit: the chi squared and the values of the free
+    parameters of the final model (of the best GA organism if runLM is
+    'no'), the file of the final model (None if LM was not run), the
+    parameters close to their boundaries, the number of generations and
+    imfit runs of the GA and the time spent in seconds """
+    def __init__(self, resultsDir, chisq, values, generations, evaluations):
+        self.resultsDir = resultsDir
+        self.chisq = chisq
+        self.values = values
+        self.resultFile = None
+        self.badParams = []
+        self.generations = generations
+        self.evaluations = evaluations
+        self.timeSpent = 0.0
+
+    def __repr__(self):
+        return "FitResult(chisq=%1.5f, generations=%i, evaluations=%i)" % (self.chisq, self.generations,
+                                                                           self.evaluations)
+
+
+class FutureResult(object):
+    """ Gives a concurrent.futures future the ready/get interface of
+    the multiprocessing async results """
+    def __init__(self, future):
+        self.future = future
+
+    def ready(self):
+        return self.future.done()
+
+    def get(self):
+        return self.future.result()
+
+
+class FitCancelled(RuntimeError):
+    """ Raised by run_fit when the fit is cancelled """
+    pass
+
+
+class FitJob(object):
+    """ One fit: its parameters, the directory for the results, the log
+    file and the pool (or concurrent.futures executor) the imfit runs
+    are sent to. If 'cores' is given,
+    at most that many runs of the job are in the pool at once, so that
+    the jobs sharing one pool get equal shares of it. The fit reports
+    its stage, generation, fitness and number of imfit runs to the
+    'progress' dictionary and stops when the 'cancelled' event is set. """
+    def __init__(self, params, resultsDir, pool, logFile, cores=None, progress=None, cancelled=None):
+        self.params = params
+        self.resultsDir = resultsDir
+        self.pool = pool
+        self.logFile = logFile
+        self.cores = cores or params.numOfCores
+        self.slots = None
+        if cores is not None:
+            self.slots = threading.BoundedSemaphore(cores)
+        self.progress = progress if progress is not None else {}
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+
+    def check_cancelled(self, lmRunner=None):
+        """ Raises FitCancelled (stopping the LM runs of the lmRunner
+        first) if the fit was cancelled """
+        if self.cancelled.is_set():
+            if lmRunner is not None:
+                for ident in lmRunner.active():
+                    lmRunner.cancel(ident, "fit cancelled")
+            raise FitCancelled("Fit cancelled")
+
+    def submit(self, func, args):
+        """ Sends the run to the pool (waiting for a free slot of the
+        job) and returns its async result """
+        if self.slots is not None:
+            self.slots.acquire()
+
+        def release(result):
+            self.slots.release()
+        if not hasattr(self.pool, "apply_async"):
+            future = self.pool.submit(func, *args)
+            if self.slots is not None:
+                future.add_done_callback(release)
+            return FutureResult(future)
+        if self.slots is None:
+            return self.pool.apply_async(func, args)
+        return self.pool.apply_async(func, args, callback=release, error_callback=release)
+
+
+def imfit_data_options(params, prefix=""):
+    """ Returns the part of imfit command line describing the data
+    (PSF, mask, noise, etc). The prefix is prepended to relative
+    file names. """
+    options = ""
+    if params.PSF != "none":
+        options += " --psf %s " % path.join(prefix, params.PSF)
+    if params.mask != "none":
+        options += " --mask %s " % path.join(prefix, params.mask)
+    if params.weight != "none":
+        options += " --noise %s " % path.join(prefix, params.weight)
+    if params.readNoise != "none":
+        options += " --readnoise=%1.2f " % (params.readNoise)
+    if params.gain != "none":
+        options += " --gain=%1.2f " % (params.gain)
+    return options
+
+
+def read_reduced_chisq(stdoutFileName):
+    """ Returns the reduced chi squared from imfit output
+    (1e10 if there is none) """
     chisq = 1e10
-    stdoutFileName = "%s/results/stdout_%s.dat" % (getcwd(), uuid.uuid4())
+    for line in open(stdoutFileName):
+        if "Reduced Chi^2 =" in line:
+            chisq = float(line.split()[3])
+    return chisq
+
+
+def read_fit_progress(stdoutFileName):
+    """ Returns the list of fit statistic values of the LM iterations
+    printed by imfit so far """
+    progress = []
+    for line in open(stdoutFileName):
+        match = fitProgressRe.search(line)
+        if match is not None:
+            progress.append(float(match.group(1)))
+    return progress
+
+
+def run_imfit_parallel(runString, resultsDir, fname=None):
+    stdoutFileName = "%s/stdout_%s.dat" % (resultsDir, uuid.uuid4())
     stdoutFile = open(stdoutFileName, "w")
     proc = subprocess.Popen(runString, stdout=stdoutFile, shell=True)
     proc.wait()
     stdoutFile.close()
-    for line in open(stdoutFileName):
-        if "Reduced Chi^2 =" in line:
-            chisq = float(line.split()[3])
+    chisq = read_reduced_chisq(stdoutFileName)
     remove(stdoutFileName)
     if fname is not None:
         remove(fname)
     return chisq
 
 
+def run_imfit_lm(runString, stdoutFileName, period):
+    """ Runs an LM optimisation keeping imfit output in stdoutFileName, so
+    that its progress can be followed. The run is stopped when the
+    stdoutFileName.cancel file appears (checked every 'period' seconds);
+    the output of a stopped run is removed and 1e10 is returned. """
+    cancelFileName = stdoutFileName + ".cancel"
+    if path.exists(cancelFileName):
+        remove(cancelFileName)
+        return 1e10
+    stdoutFile = open(stdoutFileName, "w")
+    proc = subprocess.Popen(runString, stdout=stdoutFile, shell=True, start_new_session=True)
+    while True:
+        try:
+            proc.wait(timeout=period)
+            break
+        except subprocess.TimeoutExpired:
+            if path.exists(cancelFileName):
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait()
+    stdoutFile.close()
+    if path.exists(cancelFileName):
+        remove(cancelFileName)
+        remove(stdoutFileName)
+        return 1e10
+    return read_reduced_chisq(stdoutFileName)
+
+
+def hopeless(params, progress, bestStat, horizon):
+    """ Checks if an LM run is dominated: after lmRaceMinIter iterations
+    its fit statistic is more than lmRaceMargin above the best statistic
+    of the other runs, and it would stay so even if it kept improving
+    at the rate of its last iteration for 'horizon' more iterations
+    (LM slows down, so this projection is optimistic) """
+    if (len(progress) < max(params.lmRaceMinIter, 2)) or (progress[-1] <= bestStat * (1 + params.lmRaceMargin)):
+        return False
+    projected = progress[-1] * (progress[-1] / progress[-2]) ** horizon
+    return projected > bestStat * (1 + params.lmRaceMargin)
+
+
+class LMRunner(object):
+    """ Runs LM optimisations of the job in the background: the runs go
+    to the executor of the job (see run_imfit_lm), at most
+    job.cores // LMCores of them at once, the others wait in a queue.
+    The main loop calls poll() to start waiting runs and collect
+    finished ones, so the runs can overlap with the last GA generations.
+    If 'race' is set, the progress of every run is read from its output
+    (in the results directory) and dominated runs are cancelled (see
+    hopeless). Cancelled runs get the reduced chi squared 1e10. """
+    def __init__(self, job, race=False):
+        self.job = job
+        self.logFile = job.logFile
+        self.race = race
+        self.slots = max(1, job.cores // job.params.LMCores)
+        self.chiSqValues = {}
+        self.waiting = []
+        self.running = {}
+        # cancelled runs which are not stopped yet
+        self.stopping = {}
+        self.finishedStats = []
+        # the longest run so far, in iterations
+        self.maxIterations = 0
+
+    def submit(self, ident, runString):
+        self.waiting.append((ident, runString))
+        self.poll()
+
+    def active(self):
+        """ Idents of the runs which are not finished yet """
+        return [ident for ident, runString in self.waiting] + list(self.running)
+
+    def cancel(self, ident, reason):
+        """ Stops the run (or removes it from the queue) """
+        self.chiSqValues[ident] = 1e10
+        if ident in self.running:
+            result, stdoutFileName = self.running.pop(ident)
+            if result.ready():
+                remove(stdoutFileName)
+            else:
+                # the worker stops the run when the file appears
+                open(stdoutFileName + ".cancel", "w").close()
+                self.stopping[ident] = (result, stdoutFileName)
+        else:
+            self.waiting = [(i, r) for i, r in self.waiting if i != ident]
+        print("LM run %i cancelled (%s)" % (ident, reason))
+        self.logFile.write("LM run %i cancelled (%s)\n" % (ident, reason))
+
+    def poll(self):
+        """ Collects finished runs, cancels dominated ones and starts
+        waiting runs in the free slots """
+        for i in list(self.stopping):
+            result, stdoutFileName = self.stopping[i]
+            if result.ready():
+                # the run could finish before it was told to stop
+                remove(stdoutFileName + ".cancel")
+                remove(stdoutFileName)
+                del self.stopping[i]
+        progress = {}
+        for i, (result, stdoutFileName) in self.running.items():
+            # the output file appears when the executor starts the run
+            progress[i] = read_fit_progress(stdoutFileName) if path.exists(stdoutFileName) else []
+        self.maxIterations = max([self.maxIterations] + [len(prog) for prog in progress.values()])
+        for i in list(self.running):
+            result, stdoutFileName = self.running[i]
+            if result.ready():
+                self.chiSqValues[i] = result.get()
+                if progress[i]:
+                    self.finishedStats.append(progress[i][-1])
+                remove(stdoutFileName)
+                del self.running[i]
+        if self.race:
+            for i in list(self.running):
+                # LM decreases the fit statistic, so the current values are upper
+                # bounds of the final ones
+                others = [progress[j][-1] for j in self.running if (j != i) and progress[j]] + self.finishedStats
+                horizon = max(self.maxIterations, 2 * len(progress[i])) - len(progress[i])
+                if others and hopeless(self.job.params, progress[i], min(others), horizon):
+                    self.cancel(i, "dominated at iteration %i, fit statistic %1.5e" % (len(progress[i]),
+                                                                                     progress[i][-1]))
+        while self.waiting and (len(self.running) < self.slots):
+            i, runString = self.waiting.pop(0)
+            # a unique name: a stop file left by a cancelled fit must not stop
+            # the runs of a rerun
+            stdoutFileName = "%s/stdout_lm_%i_%s.dat" % (self.job.resultsDir, i, uuid.uuid4().hex[:8])
+            result = self.job.submit(run_imfit_lm, [runString, stdoutFileName, self.job.params.lmRacePeriod])
+            self.running[i] = (result, stdoutFileName)
+
+    def wait(self):
+        """ Waits for all the runs and returns the dictionary of
+        their reduced chi squared values """
+        while self.waiting or self.running or self.stopping:
+            time.sleep(self.job.params.lmRacePeriod)
+            self.job.check_cancelled(self)
+            self.poll()
+        return self.chiSqValues
+
+
+def submit_lm_starts(job, pop, lmRunner, lmStarts, final=False):
+    """ Submits LM runs for the current LM starts of the population
+    which have no run yet. 'lmStarts' is the list of (ident, organism)
+    of the runs submitted so far, it is extended in place. Before the
+    end of the GA at most numOfLM runs are active: a new start replaces
+    the worst stale run (the one started from an organism which is not
+    a current start anymore) only if it is fitter by lmStaleMargin.
+    At the end all the current starts are submitted and the active stale
+    runs which are worse than all of them by lmStaleMargin are cancelled.
+    The runs submitted before the end share the executor with the GA
+    evaluations, so they use one thread each, like the evaluations. """
+    starts = select_lm_starts(job.params, pop)
+    margin = 1 - job.params.lmStaleMargin
+    for org in starts:
+        if any(org is started for ident, started in lmStarts):
+            continue
+        active = lmRunner.active()
+        stale = [(ident, started) for ident, started in lmStarts
+                 if (ident in active) and not any(started is s for s in starts)]
+        if (not final) and (len(active) >= job.params.numOfLM):
+            if not stale:
+                continue
+            ident, worst = max(stale, key=lambda run: run[1].get_fitness())
+            if org.get_fitness() >= worst.get_fitness() * margin:
+                continue
+            lmRunner.cancel(ident, "stale start, chi^2 %1.5f vs %1.5f" % (worst.get_fitness(), org.get_fitness()))
+        ident = len(lmStarts)
+        org.run_lm_optimisation(ident, lmRunner, threads=None if final else 1)
+        lmStarts.append((ident, org))
+        job.logFile.write("LM run %i submitted (chi^2 of the start %1.5f)\n" % (ident, org.get_fitness()))
+    if final:
+        worstStart = max(org.get_fitness() for org in starts)
+        active = lmRunner.active()
+        for ident, started in lmStarts:
+            if (ident in active) and not any(started is s for s in starts) and \
+                    (started.get_fitness() * margin > worstStart):
+                lmRunner.cancel(ident, "stale start, chi^2 %1.5f" % started.get_fitness())
+
+
+def run_bootstrap(job, resultFile):
+    """ Estimates parameter uncertainties by imfit bootstrap resampling
+    started from the final model. bootstrapIter iterations are split
+    into chunks run in parallel in the pool with independent seeds, their
+    tables are merged into results/bootstrap.dat and summarised in
+    results/bootstrap_summary.dat """
+    params = job.params
+    logFile = job.logFile
+    numChunks = min(params.bootstrapChunks or job.cores, params.bootstrapIter)
+    chunkSizes = [len(chunk) for chunk in array_split(arange(params.bootstrapIter), numChunks)]
+    seedRng = default_rng(None if params.seed == "none" else int(params.seed))
+    seeds = seedRng.choice(2**31 - 1, size=numChunks, replace=False) + 1
+    imfit_binary = path.join(params.imfitPath, "imfit")
+    results = []
+    chunkFiles = []
+    for i, (size, seed) in enumerate(zip(chunkSizes, seeds)):
+        chunkFile = "%s/bootstrap_%i.dat" % (job.resultsDir, i)
+        runString = "%s -c %s %s " % (imfit_binary, resultFile, params.fitsToFit)
+        runString += " --max-threads 1 --bootstrap %i --seed %i " % (size, seed)
+        runString += " --save-bootstrap %s --save-params /dev/null " % (chunkFile)
+        runString += imfit_data_options(params)
+        runString += " %s " % (params.addImfitStr)
+        results.append(job.submit(run_imfit_parallel, [runString, job.resultsDir]))
+        chunkFiles.append(chunkFile)
+    for result in results:
+        result.get()
+    chunkFiles = [f for f in chunkFiles if os.path.exists(f)]
+    if not chunkFiles:
+        print("Bootstrap failed: no output of imfit")
+        logFile.write("Bootstrap failed: no output of imfit\n")
+        return
+    names, values = merge_bootstrap_files(chunkFiles, "%s/bootstrap.dat" % job.resultsDir)
+    for f in chunkFiles:
+        remove(f)
+    bestValues = [par.value for key, par in ImfitModel(resultFile, quiet=True).free_params()]
+    if len(bestValues) != len(names):
+        bestValues = None
+    save_bootstrap_summary(names, values, "%s/bootstrap_summary.dat" % job.resultsDir, bestValues)
+    print("Bootstrap: %i iterations in %i chunks (see 'bootstrap_summary.dat')" % (len(values), len(chunkFiles)))
+    logFile.write("Bootstrap: %i iterations in %i chunks\n" % (len(values), len(chunkFiles)))
+
+
+def select_lm_starts(params, pop):
+    """ Organisms to start the LM optimisation from: the best organisms
+    of distinct clusters if lmMinDistance (or nicheRadius with niching)
+    is set, else just the best ones """
+    lmMinDistance = params.lmMinDistance
+    if params.niching != "none":
+        lmMinDistance = max(lmMinDistance, params.nicheRadius)
+    if lmMinDistance > 0:
+        # close duplicates of already chosen organisms are skipped
+        return pop.nicheLeaders(params.numOfLM, lmMinDistance)
+    return sorted(pop)[0:params.numOfLM]
+
+
 class Converger(MendelOrganism):
     """
-    Implements the organism which tries to converge a function
+    Implements the organism which tries to converge a function.
+    The model, genome and job are set by make_converger
     """
-    model = ImfitModel(sys.argv[1])
-    genome = model.create_genome()
+    model = None
+    genome = None
+    job = None
 
     def prepare_fitness(self):
         genome = {}
         for key in self.genes.keys():
             genome[key] = self[key]
         self.model.genome_to_model(genome)
-        fname = self.model.create_input_file(fixAll=True)
-        imfit_binary = path.join(gParams.imfitPath, "imfit")
-        runString = "%s -c %s %s " % (imfit_binary, fname, gParams.fitsToFit)
+        fname = self.model.create_input_file(fixAll=True, directory=self.job.resultsDir)
+        imfit_binary = path.join(self.job.params.imfitPath, "imfit")
+        runString = "%s -c %s %s " % (imfit_binary, fname, self.job.params.fitsToFit)
         runString += " --fitstat-only --max-threads 1 "
         runString += " --save-params /dev/null "
-        if gParams.PSF != "none":
-            runString += " --psf %s " % (gParams.PSF)
-        if gParams.mask != "none":
-            runString += " --mask %s " % (gParams.mask)
-        if gParams.weight != "none":
-            runString += " --noise %s " % (gParams.weight)
-        if gParams.readNoise != "none":
-            runString += " --readnoise=%1.2f " % (gParams.readNoise)
-        if gParams.gain != "none":
-            runString += " --gain=%1.2f " % (gParams.gain)
-        runString += " %s " % (gParams.addImfitStr)
-        result = pool.apply_async(run_imfit_parallel, [runString, fname])
+        runString += imfit_data_options(self.job.params)
+        runString += " %s " % (self.job.params.addImfitStr)
+        result = self.job.submit(run_imfit_parallel, [runString, self.job.resultsDir, fname])
         self.chisq = result
 
+    def fitnessReady(self):
+        return self.chisq.ready()
+
     def fitness(self):
         return self.chisq.get()
 
     def save_results(self, outFile):
-        fname = self.model.create_input_file(fixAll=True)
-        makeimage_binary = path.join(gParams.imfitPath, "makeimage")
-        runString = "%s %s --refimage %s " % (makeimage_binary, fname, gParams.fitsToFit)
-        if gParams.PSF != "none":
-            runString += " --psf %s " % (gParams.PSF)
+        # the model is shared by the organisms: set it to this one
+        self.model.genome_to_model(dict((key, self[key]) for key in self.genes.keys()))
+        fname = self.model.create_input_file(fixAll=True, directory=self.job.resultsDir)
+        makeimage_binary = path.join(self.job.params.imfitPath, "makeimage")
+        runString = "%s %s --refimage %s " % (makeimage_binary, fname, self.job.params.fitsToFit)
+        if self.job.params.PSF != "none":
+            runString += " --psf %s " % (self.job.params.PSF)
         runString += "--output %s" % (outFile)
         proc = subprocess.Popen(runString, stdout=subprocess.PIPE, shell=True)
         proc.wait()
         remove(fname)
 
-    def run_lm_optimisation(self, ident):
-        fname = "%s/results/%i_lm_input.dat" % (getcwd(), ident)
+    def run_lm_optimisation(self, ident, lmRunner=None, threads=None):
+        """ Starts the final LM optimisation of the organism in the pool
+        (or by lmRunner if it is given) and returns its async result; if
+        runLM is 'no', just writes the run string to the run_lm.sh script.
+        imfit uses 'threads' threads (LMCores by default) """
+        fname = "%s/%i_lm_input.dat" % (self.job.resultsDir, ident)
         genome = {}
         for key in self.genes.keys():
             genome[key] = self[key]
@@ -94,157 +463,367 @@ class Converger(MendelOrganism):
         self.model.create_input_file(fname)
         # If we are NOT going to run LM optimisation right now, then
         # save run strings in a file for the future
-        imfit_binary = path.join(gParams.imfitPath, "imfit")
-        if gParams.runLM == "no":
-            script = open("%s/results/run_lm.sh" % (getcwd()), "a")
-            runString = "%s -c %i_lm_input.dat ../%s " % (imfit_binary, ident, gParams.fitsToFit)
-            if gParams.PSF != "none":
-                runString += " --psf ../%s " % (gParams.PSF)
-            if gParams.mask != "none":
-                runString += " --mask ../%s " % (gParams.mask)
-            if gParams.weight != "none":
-                runString += " --noise ../%s " % (gParams.weight)
-            if gParams.readNoise != "none":
-                runString += " --readnoise=%1.2f " % (gParams.readNoise)
-            if gParams.gain != "none":
-                runString += " --gain=%1.2f " % (gParams.gain)
+        imfit_binary = path.join(self.job.params.imfitPath, "imfit")
+        if self.job.params.runLM == "no":
+            script = open("%s/run_lm.sh" % (self.job.resultsDir), "a")
+            # data file names relative to the results directory
+            prefix = path.relpath(getcwd(), self.job.resultsDir)
+            runString = "%s -c %i_lm_input.dat %s " % (imfit_binary, ident,
+                                                       path.join(prefix, self.job.params.fitsToFit))
+            runString += imfit_data_options(self.job.params, prefix=prefix)
             runString += "--ftol 0.00001"
             runString += " --save-params %i_lm_result.dat " % (ident)
             runString += " --save-model %i_lm_model.fits " % (ident)
             runString += " --save-residual %i_lm_residual.fits " % (ident)
-            runString += " %s \n\n" % (gParams.addImfitStr)
+            runString += " %s \n\n" % (self.job.params.addImfitStr)
             script.write(runString)
             script.close()
             return
         else:
-            runString = "%s -c %s %s " % (imfit_binary, fname, gParams.fitsToFit)
-            runString += " --max-threads %i " % (gParams.LMCores)
-            if gParams.PSF != "none":
-                runString += " --psf %s " % (gParams.PSF)
-            if gParams.mask != "none":
-                runString += " --mask %s " % (gParams.mask)
-            if gParams.weight != "none":
-                runString += " --noise %s " % (gParams.weight)
-            if gParams.readNoise != "none":
-                runString += " --readnoise=%1.2f " % (gParams.readNoise)
-            if gParams.gain != "none":
-                runString += " --gain=%1.2f " % (gParams.gain)
+            runString = "%s -c %s %s " % (imfit_binary, fname, self.job.params.fitsToFit)
+            runString += " --max-threads %i " % (threads or self.job.params.LMCores)
+            runString += imfit_data_options(self.job.params)
             runString += "--ftol 0.00001"
-            runString += " --save-params %s/results/%i_lm_result.dat " % (getcwd(), ident)
-            runString += " --save-model %s/results/%i_lm_model.fits " % (getcwd(), ident)
-            runString += " --save-residual %s/results/%i_lm_residual.fits " % (getcwd(), ident)
-            runString += " %s \n\n" % (gParams.addImfitStr)
-            result = pool.apply_async(run_imfit_parallel, [runString])
+            runString += " --save-params %s/%i_lm_result.dat " % (self.job.resultsDir, ident)
+            runString += " --save-model %s/%i_lm_model.fits " % (self.job.resultsDir, ident)
+            runString += " --save-residual %s/%i_lm_residual.fits " % (self.job.resultsDir, ident)
+            runString += " %s \n\n" % (self.job.params.addImfitStr)
+            if lmRunner is not None:
+                lmRunner.submit(ident, runString)
+                return
+            result = self.job.submit(run_imfit_parallel, [runString, self.job.resultsDir])
             return result
 
+    def run_local_search(self, ident):
+        """ Starts a short LM optimisation of the organism in the pool
+        (memetic mode). The optimisation is bounded by a loose ftol
+        and uses a single core. Returns the async result of the run and
+        the name of the file where the refined parameters will be saved. """
+        fname = "%s/memetic_%i_input.dat" % (self.job.resultsDir, ident)
+        resultName = "%s/memetic_%i_result.dat" % (self.job.resultsDir, ident)
+        genome = {}
+        for key in self.genes.keys():
+            genome[key] = self[key]
+        self.model.genome_to_model(genome)
+        self.model.create_input_file(fname)
+        imfit_binary = path.join(self.job.params.imfitPath, "imfit")
+        runString = "%s -c %s %s " % (imfit_binary, fname, self.job.params.fitsToFit)
+        runString += " --max-threads 1 --ftol %g " % (self.job.params.memeticFTol)
+        runString += imfit_data_options(self.job.params)
+        runString += " --save-params %s " % (resultName)
+        runString += " %s " % (self.job.params.addImfitStr)
+        return self.job.submit(run_imfit_parallel, [runString, self.job.resultsDir, fname]), resultName
+
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: ./cluster_imfit.py  model.imfit config.dat")
+def save_checkpoint(job, pop, iGen, restartGen, bestFitness, avgFitness):
+    """ Saves the state of the GA at the start of the generation iGen to
+    resultsDir/checkpoint.npz. The file is replaced atomically, so an
+    interrupted run always leaves a complete checkpoint """
+    fileName = path.join(job.resultsDir, "checkpoint.npz")
+    state = pop.getState()
+    state.update(optimizer=array(job.params.optimizer), generation=array([iGen, restartGen]),
+                 bestFitness=array(bestFitness, dtype=float), avgFitness=array(avgFitness, dtype=float))
+    fout = open(fileName + ".tmp", "wb")
+    savez(fout, **state)
+    fout.flush()
+    os.fsync(fout.fileno())
+    fout.close()
+    os.replace(fileName + ".tmp", fileName)
 
-    logFileName = "%s/log.dat" % (getcwd())
-    logFile = open(logFileName, "a", buffering=1)
-    logFile.write("\n\n\n################################\n")
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("model")
-    parser.add_argument("config")
-    for key, value in GeneralParams(sys.argv[2]).params.items():
-        parser.add_argument("--%s" % key, default=value, type=type(value))
-    gParams = parser.parse_args()
-    pop = Population(species=Converger, init=gParams.zeroGenSize,
-                     childCount=gParams.popSize,
-                     childCull=gParams.selectNbest,
-                     numNewOrganisms=gParams.addNew)
+def load_checkpoint(job, pop):
+    """ Restores the state of the GA from resultsDir/checkpoint.npz.
+    Returns (iGen, restartGen, bestFitness, avgFitness) or None if there
+    is no checkpoint """
+    fileName = path.join(job.resultsDir, "checkpoint.npz")
+    if not os.path.exists(fileName):
+        return None
+    state = dict(load(fileName))
+    if str(state["optimizer"]) != job.params.optimizer:
+        raise RuntimeError("Checkpoint %s was made by the '%s' optimizer" % (fileName, state["optimizer"]))
+    try:
+        pop.setState(state)
+    except ValueError as err:
+        raise RuntimeError("Cannot resume from %s: %s" % (fileName, err))
+    iGen, restartGen = [int(v) for v in state["generation"]]
+    return iGen, restartGen, list(state["bestFitness"]), list(state["avgFitness"])
+
+
+def check_seed_fitness(pop, model, ftns, values, logFile):
+    """ Evaluates the organism of the best row of a seed file and warns
+    if its chi squared is not the one logged in the file (the file is of
+    another image or model, or its rows are broken) """
+    genome = model.encode_genome(values)
+    if len(genome) != len(pop.geneNames):
+        # some parameters are not in the file, their genes are random
+        return
+    org = pop.organism(pop.homozygous(array([[genome[name] for name in pop.geneNames]]))[0])
+    org.prepare_fitness()
+    chisq = org.get_fitness()
+    # the values are written with a few digits only
+    if abs(chisq - ftns) > 0.05 * ftns:
+        print("Warning: the best seed has chi2=%1.3f, but %1.3f is logged for it" % (chisq, ftns))
+        logFile.write("Warning: the best seed has chi2=%1.3f, but %1.3f is logged for it\n" % (chisq, ftns))
+
+
+def drop_generation_rows(textFile, firstGen):
+    """ Removes the rows of generations firstGen and later from the
+    genTextFile, so that a resumed run does not write them twice """
+    if not os.path.exists(textFile):
+        return
+    lines = [line for line in open(textFile)
+             if line.startswith("#") or (len(line.strip()) == 0) or (int(line.split()[0]) < firstGen)]
+    fout = open(textFile + ".tmp", "w")
+    fout.writelines(lines)
+    fout.close()
+    os.replace(textFile + ".tmp", textFile)
+
 
-    if not os.path.exists("%s/results" % getcwd()):
-        os.makedirs("%s/results" % getcwd())
-    if (gParams.saveGens == "yes") and (not os.path.exists("%s/results/generations/" % getcwd())):
-        os.makedirs("%s/results/generations/" % getcwd())
-    pool = Pool(gParams.numOfCores)
+def make_converger(job, model):
+    """ Returns the Converger subclass fitting the model within the job """
+    return type("Converger", (Converger,), {"model": model, "genome": model.create_genome(), "job": job})
+
+
+def run_fit(job, modelFileName, quiet=False, resume=False):
+    """ Fits the model of the file: runs the GA (or the other optimizer)
+    and the LM optimisation of its best organisms, saving the results to
+    job.resultsDir. If resume is True, the GA continues from the
+    checkpoint of the results directory. Returns the chi squared of the
+    final model (of the best organism if runLM is 'no'). Raises
+    RuntimeError if the fit cannot be done. """
+    gParams = job.params
+    logFile = job.logFile
+    if gParams.optimizer not in optimizers:
+        raise RuntimeError("Unknown optimizer '%s' (possible values: %s)" % (gParams.optimizer,
+                                                                            ", ".join(optimizers)))
+    if gParams.geneEncoding not in ("linear", "auto"):
+        raise RuntimeError("Unknown geneEncoding '%s' (possible values: linear, auto)" % gParams.geneEncoding)
+    model = ImfitModel(modelFileName, quiet=quiet)
+    if gParams.tieCentres == "yes":
+        model.tie_centres()
+        print("All functions share the same centre")
+    model.set_encoding(gParams.geneEncoding)
+    species = make_converger(job, model)
+    seeds = []
+    initSeeds = []
+    if gParams.initSeedFile != "none":
+        # the best distinct rows, the rest of the zero generation covers the space
+        seeds = read_seed_file(gParams.initSeedFile, withFitness=True)
+        seeds = seeds[:max(1, int(gParams.initSeedFraction * gParams.zeroGenSize))]
+        initSeeds = [model.encode_genome(values) for seedFtns, values in seeds]
+        print("%i organisms of the zero generation are taken from %s" % (len(initSeeds), gParams.initSeedFile))
+    pop = optimizers[gParams.optimizer](species=species, init=gParams.zeroGenSize,
+                                        childCount=gParams.popSize,
+                                        childCull=gParams.selectNbest,
+                                        numNewOrganisms=gParams.addNew,
+                                        selection=gParams.selection,
+                                        selectionPressure=gParams.selectionPressure,
+                                        crossover=gParams.crossover,
+                                        mutation=gParams.mutation,
+                                        mutationControl=gParams.mutationControl,
+                                        initMethod=gParams.initMethod,
+                                        initCenter=model.model_to_genome(),
+                                        initSigma=gParams.initSigma,
+                                        initSeeds=initSeeds,
+                                        surrogate=(gParams.surrogate == "yes"),
+                                        surrogateFraction=gParams.surrogateFraction,
+                                        surrogateExplore=gParams.surrogateExplore,
+                                        niching=gParams.niching,
+                                        nicheRadius=gParams.nicheRadius,
+                                        restartGrowth=gParams.restartGrowth,
+                                        seed=None if gParams.seed == "none" else int(gParams.seed))
 
     startTime = time.time()
     iGen = 0
+    # generation of the last restart: the stopping conditions look
+    # only at the generations after it
+    restartGen = 0
+    # LM runs started before the end of the GA
+    lmRunner = None
+    lmStarts = []
     bestFitness = []
     avgFitness = []
-    print("Starting genetic algorithm")
-    logFile.write("GA optimisation started at %s\n" % datetime.datetime.now().strftime("%d.%m.%Y %H:%M"))
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(job, pop)
+        if checkpoint is None:
+            print("No checkpoint in %s, starting from the zero generation" % job.resultsDir)
+            logFile.write("No checkpoint in %s, starting from the zero generation\n" % job.resultsDir)
+    if (checkpoint is None) and seeds and (seeds[0][0] is not None):
+        check_seed_fitness(pop, model, seeds[0][0], seeds[0][1], logFile)
+    if checkpoint is not None:
+        iGen, restartGen, bestFitness, avgFitness = checkpoint
+        if gParams.genTextFile is not None:
+            # the run could be stopped after the row of the checkpoint generation
+            drop_generation_rows(gParams.genTextFile, iGen)
+        print("Resuming optimisation (%s) from generation %i" % (gParams.optimizer, iGen))
+        logFile.write("GA optimisation (%s) resumed from generation %i at %s\n" % (
+            gParams.optimizer, iGen, datetime.datetime.now().strftime("%d.%m.%Y %H:%M")))
+    else:
+        print("Starting optimisation (%s)" % gParams.optimizer)
+        logFile.write("GA optimisation (%s) started at %s\n" % (gParams.optimizer,
+                                                                datetime.datetime.now().strftime("%d.%m.%Y %H:%M")))
     while 1:
         best = pop.best()
         ftns = best.get_fitness()
         avgFtns = pop.fitness()
+        if gParams.checkpoint == "yes":
+            save_checkpoint(job, pop, iGen, restartGen, bestFitness, avgFitness)
+        job.progress.update(stage="GA", generation=iGen, best=float(ftns), average=float(avgFtns),
+                            evaluations=int(pop.evaluations))
+        job.check_cancelled(lmRunner)
         print("generation %i: best=%8.5f average=%8.5f" % (iGen, ftns, avgFtns), end='')
         logFile.write("generation %i: best=%8.5f average=%8.5f" % (iGen, ftns, avgFtns))
         bestFitness.append(ftns)
         avgFitness.append(avgFtns)
+        geneSpread = pop.geneSpread()
+        leastDiverse = argmin(geneSpread)
+        logFile.write(" spread=%1.3e (min %1.3e for %s) distance=%1.3e" % (geneSpread.mean(),
+                                                                          geneSpread[leastDiverse],
+                                                                          pop.geneNames[leastDiverse],
+                                                                          pop.meanDistance()))
 
         if isnan(ftns) or isnan(avgFtns):
-            print("\nNaN values found in model images. Aborting...")
-            logFile.write("\nNaN values found in model images. Aborting...")
-            exit(1)
+            raise RuntimeError("NaN values found in model images")
         if gParams.saveGens == "yes":
-            best.save_results("%s/results/generations/gen_%03i.fits" % (getcwd(), iGen))
+            best.save_results("%s/generations/gen_%03i.fits" % (job.resultsDir, iGen))
         if gParams.genTextFile is not None:
-            best.model.model_to_text(iGen, ftns, gParams.genTextFile)
-        if (iGen > gParams.fSpan):
+            # the shared model holds the last evaluated organism
+            model.genome_to_model(dict((key, best[key]) for key in best.genes.keys()))
+            model.model_to_text(iGen, ftns, gParams.genTextFile,
+                                [("mutScale", pop.mutationScale), ("successRate", pop.successRate)])
+        converged = False
+        tightening = False
+        if (iGen - restartGen > gParams.fSpan):
             relBestFitnessChange = abs(bestFitness[-1] - bestFitness[-gParams.fSpan]) / bestFitness[-1]
             relAvgFitnessChange = abs(avgFitness[-1]-avgFitness[-gParams.fSpan]) / avgFitness[-1]
             print(" (delta=%1.5e)" % (max(relBestFitnessChange, relAvgFitnessChange)))
             logFile.write(" (delta=%1.5e)\n" % (max(relBestFitnessChange, relAvgFitnessChange)))
-            if (relBestFitnessChange < gParams.fTol) and (relAvgFitnessChange < gParams.fTol):
-                print("\n GA method converged")
-                logFile.write("\n GA method converged\n")
-                break
+            converged = (relBestFitnessChange < gParams.fTol) and (relAvgFitnessChange < gParams.fTol)
+            tightening = max(relBestFitnessChange, relAvgFitnessChange) < gParams.lmEarlyStart * gParams.fTol
+            if (not converged) and (gParams.minDiversity > 0):
+                # Stagnation: the best fitness is on a plateau and the population has collapsed
+                diversity = pop.diversity()
+                if (relBestFitnessChange < gParams.fTol) and (diversity < gParams.minDiversity):
+                    print(" Population diversity %1.3e is below minDiversity" % diversity)
+                    logFile.write(" Population diversity %1.3e is below minDiversity\n" % diversity)
+                    converged = True
         else:
             print("")
             logFile.write("\n")
+        if (gParams.maxEvaluations > 0) and (pop.evaluations >= gParams.maxEvaluations):
+            print("\n Evaluation budget (%i imfit runs) exhausted." % gParams.maxEvaluations)
+            logFile.write("\n Evaluation budget (%i imfit runs) exhausted.\n" % gParams.maxEvaluations)
+            break
+        if converged:
+            if pop.restarts >= gParams.maxRestarts:
+                print("\n GA method converged")
+                logFile.write("\n GA method converged\n")
+                break
+            pop.reseed(gParams.restartElite)
+            restartGen = iGen
+            print("\n Stagnation: restart %i, population is reseeded keeping %i best organisms" % (
+                pop.restarts, gParams.restartElite))
+            logFile.write("\n Stagnation: restart %i, population is reseeded keeping %i best organisms\n" % (
+                pop.restarts, gParams.restartElite))
         if iGen >= gParams.maxGenNumber:
             print("\n Maximum number of generation reached.")
             logFile.write("\n Maximum number of generation reached.\n")
             break
+        if tightening and (gParams.runLM == "yes") and not converged:
+            # The GA is close to convergence: start LM from the current best
+            # organisms while the last generations are computed
+            if lmRunner is None:
+                print(" Starting L-M optimisation in background")
+                logFile.write(" Starting L-M optimisation in background\n")
+                lmRunner = LMRunner(job, race=(gParams.lmRace == "yes"))
+            submit_lm_starts(job, pop, lmRunner, lmStarts)
         iGen += 1
+        localSearches = []
+        if (gParams.memeticPeriod > 0) and (iGen % gParams.memeticPeriod == 0):
+            # Refine the best organisms while the next generation is evaluated
+            localSearches = [(org, org.run_local_search(i)) for i, org in enumerate(pop[:gParams.memeticNum])]
         pop.gen()
+        if lmRunner is not None:
+            lmRunner.poll()
+        if (gParams.surrogate == "yes") and (pop.savedEvaluations > 0):
+            print("surrogate: rank correlation=%1.3f, evaluations saved=%i" % (pop.surrogateCorrelation,
+                                                                              pop.savedEvaluations))
+            logFile.write("surrogate: rank correlation=%1.3f, evaluations saved=%i\n" % (pop.surrogateCorrelation,
+                                                                                        pop.savedEvaluations))
+        if localSearches:
+            numImproved = 0
+            for org, (result, resultName) in localSearches:
+                chisq = result.get()
+                if os.path.exists(resultName):
+                    refined = model.encode_genome(ImfitModel(resultName, quiet=True).model_to_values())
+                    remove(resultName)
+                    if chisq < org.get_fitness():
+                        # the chi squared of the refined organism is known
+                        pop.setPhenotype(org, refined, fitness=chisq)
+                        numImproved += 1
+            logFile.write("memetic refinement: %i of %i organisms improved\n" % (numImproved, len(localSearches)))
 
+    # parameters of the best GA organism
+    model.genome_to_model(dict((key, best[key]) for key in best.genes.keys()))
+    result = FitResult(job.resultsDir, ftns, model.model_to_values(), iGen, pop.evaluations)
     timeSpentSec = time.time() - startTime
     spentTimeString = time.strftime("%Hh:%Mm:%Ss", time.gmtime(timeSpentSec))
     print("Time spent: %s" % spentTimeString)
     logFile.write("Time spent: %s\n" % spentTimeString)
 
     if gParams.runLM == "no":
-        remove("%s/results/run_lm.sh" % getcwd())
+        remove("%s/run_lm.sh" % job.resultsDir)
     else:
         print("\n Starting L-M optimisation")
         logFile.write("\n Starting L-M optimisation\n")
-    bestOrganisms = sorted(pop)[0:gParams.numOfLM]
-    result = [org.run_lm_optimisation(i) for i, org in enumerate(bestOrganisms)]
+        job.progress.update(stage="LM")
+    bestOrganisms = select_lm_starts(gParams, pop)
+    if len(bestOrganisms) < gParams.numOfLM:
+        print("Only %i distinct organisms for LM optimisation" % len(bestOrganisms))
+        logFile.write("Only %i distinct organisms for LM optimisation\n" % len(bestOrganisms))
+    if (gParams.runLM == "yes") and ((lmRunner is not None) or (gParams.lmRace == "yes")):
+        if lmRunner is None:
+            lmRunner = LMRunner(job, race=(gParams.lmRace == "yes"))
+        submit_lm_starts(job, pop, lmRunner, lmStarts, final=True)
+        chiSqByIdent = lmRunner.wait()
+        chiSqValues = [chiSqByIdent[ident] for ident, org in lmStarts]
+    else:
+        lmResults = [org.run_lm_optimisation(i) for i, org in enumerate(bestOrganisms)]
+        if gParams.runLM == "yes":
+            chiSqValues = [r.get() for r in lmResults]
     if gParams.runLM == "yes":
-        chiSqValues = [r.get() for r in result]
         bestModelNumber = argmin(chiSqValues)
         print("\nChi.sq. of the best model = %1.3f" % (chiSqValues[bestModelNumber]))
         logFile.write("\nChi.sq. of the best model = %1.3f\n" % (chiSqValues[bestModelNumber]))
         # If LM optimisation was done then remove all models except the best one
-        for i in range(gParams.numOfLM):
+        for i in range(len(chiSqValues)):
             if i != bestModelNumber:
-                remove("%s/results/%i_lm_input.dat" % (getcwd(), i))
-                remove("%s/results/%i_lm_result.dat" % (getcwd(), i))
-                remove("%s/results/%i_lm_model.fits" % (getcwd(), i))
-                remove("%s/results/%i_lm_residual.fits" % (getcwd(), i))
+                remove("%s/%i_lm_input.dat" % (job.resultsDir, i))
+                remove("%s/%i_lm_result.dat" % (job.resultsDir, i))
+                remove("%s/%i_lm_model.fits" % (job.resultsDir, i))
+                remove("%s/%i_lm_residual.fits" % (job.resultsDir, i))
             else:
-                move("%s/results/%i_lm_input.dat" % (getcwd(), i), "%s/results/input.dat" % (getcwd()))
-                move("%s/results/%i_lm_result.dat" % (getcwd(), i), "%s/results/result.dat" % getcwd())
-                move("%s/results/%i_lm_model.fits" % (getcwd(), i), "%s/results/model.fits" % getcwd())
-                move("%s/results/%i_lm_residual.fits" % (getcwd(), i), "%s/results/residual.fits" % getcwd())
+                move("%s/%i_lm_input.dat" % (job.resultsDir, i), "%s/input.dat" % job.resultsDir)
+                move("%s/%i_lm_result.dat" % (job.resultsDir, i), "%s/result.dat" % job.resultsDir)
+                move("%s/%i_lm_model.fits" % (job.resultsDir, i), "%s/model.fits" % job.resultsDir)
+                move("%s/%i_lm_residual.fits" % (job.resultsDir, i), "%s/residual.fits" % job.resultsDir)
 
         print("\nChecking boundaries\n")
         # Load resulting model
-        resModel = ImfitModel("%s/results/result.dat" % getcwd())
+        resModel = ImfitModel("%s/result.dat" % job.resultsDir, quiet=quiet)
         # Store final parameters to generations file
         if gParams.genTextFile is not None:
-            resModel.model_to_text(iGen+1, chiSqValues[bestModelNumber], gParams.genTextFile)
+            resModel.model_to_text(iGen+1, chiSqValues[bestModelNumber], gParams.genTextFile,
+                                   [("mutScale", nan), ("successRate", nan)])
+        result.chisq = chiSqValues[bestModelNumber]
+        result.values = resModel.model_to_values()
+        result.resultFile = "%s/result.dat" % job.resultsDir
         # Check boundaries
         badParams = best.model.check_boundaries(resModel)
+        result.badParams = badParams
         if badParams:
-            fbad = open("%s/results/bad_params.dat" % getcwd(), "w")
+            fbad = open("%s/bad_params.dat" % job.resultsDir, "w")
             fbad.truncate(0)
             print("Warging: these parameters have values that are close to their boundaries:")
             logFile.write("Warging: some parameters have values that are close to their boundaries")
@@ -254,4 +833,114 @@ if __name__ == '__main__':
                 fbad.write("%s\n" % p)
         else:
             print("All parameters are inside of their boundaries")
-    time.sleep(1)
+        if gParams.bootstrapIter > 0:
+            job.check_cancelled()
+            job.progress.update(stage="bootstrap")
+            run_bootstrap(job, "%s/result.dat" % job.resultsDir)
+    totalTimeString = time.strftime("%Hh:%Mm:%Ss", time.gmtime(time.time() - startTime))
+    print("Total time (GA and LM): %s" % totalTimeString)
+    logFile.write("Total time (GA and LM): %s\n" % totalTimeString)
+    result.timeSpent = time.time() - startTime
+    # the fit is done: a rerun with --resume would start from scratch. If
+    # the LM stage is interrupted, the fit is resumed from the end of the GA
+    remove(path.join(job.resultsDir, "checkpoint.npz"))
+    return result
+
+
+def make_executor(params):
+    """ Creates the executor of the imfit runs given by the 'executor'
+    parameter: a pool of numOfCores processes or a batch scheduler """
+    if params.executor == "pool":
+        return Pool(params.numOfCores)
+    if params.executor == "scheduler":
+        return SchedulerExecutor(params.schedSubmit, params.schedStatus, params.schedCancel, params.schedTaskVar,
+                                 params.schedSpool, groupSize=params.schedGroupSize,
+                                 lostChecks=params.schedLostChecks)
+    raise RuntimeError("Unknown executor '%s' (possible values: pool, scheduler)" % params.executor)
+
+
+def fit(modelFileName, config, executor=None, resultsDir=None, logFile=None, cores=None, quiet=True,
+        progress=None, cancelled=None, resume=False, **overrides):
+    """ Fits the model of the file and returns a FitResult.
+
+    config is the name of a config file, a dictionary or a namespace of
+    parameters (like the ones of GeneralParams); keyword arguments
+    override its values. The imfit runs go to the executor: a
+    multiprocessing pool or a concurrent.futures executor. A warm executor
+    can be shared by many fits (also running at the same time in different
+    threads); if none is given, the one of the 'executor' parameter is
+    started for this fit. 'cores' limits the number of runs of this fit in the
+    executor at once. Results are saved to resultsDir (./results by
+    default), the log to logFile (a file name or an open file, log.dat in
+    resultsDir by default). A relative genTextFile is taken relative to
+    the parent directory of resultsDir, like ./results/generations.dat is
+    relative to the working directory of cluster_imfit.py. 'progress' and 'cancelled' are passed to the
+    FitJob to monitor and stop the fit from another thread. If resume is
+    True, the GA continues from the checkpoint in resultsDir. Raises
+    RuntimeError (FitCancelled if it was cancelled) if the fit fails. """
+    if isinstance(config, str):
+        params = dict(GeneralParams(config).params)
+    elif isinstance(config, dict):
+        params = dict(config)
+    else:
+        params = dict(vars(config))
+    params.update(overrides)
+    params = argparse.Namespace(**params)
+    if resultsDir is None:
+        resultsDir = "%s/results" % getcwd()
+    resultsDir = path.abspath(resultsDir)
+    if not os.path.exists(resultsDir):
+        os.makedirs(resultsDir)
+    if (params.genTextFile is not None) and not path.isabs(params.genTextFile):
+        # every fit gets its own file next to its results
+        params.genTextFile = path.normpath(path.join(path.dirname(resultsDir), params.genTextFile))
+    if (params.genTextFile is not None) and not os.path.exists(path.dirname(params.genTextFile)):
+        os.makedirs(path.dirname(params.genTextFile))
+    if (params.saveGens == "yes") and (not os.path.exists("%s/generations/" % resultsDir)):
+        os.makedirs("%s/generations/" % resultsDir)
+    ownLog = not hasattr(logFile, "write")
+    if ownLog:
+        logFile = open(logFile or "%s/log.dat" % resultsDir, "a", buffering=1)
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = make_executor(params)
+    try:
+        job = FitJob(params, resultsDir, executor, logFile, cores, progress, cancelled)
+        return run_fit(job, modelFileName, quiet, resume)
+    finally:
+        if ownExecutor:
+            executor.close()
+            executor.join()
+        if ownLog:
+            logFile.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: ./cluster_imfit.py  model.imfit config.dat")
+
+    logFileName = "%s/log.dat" % (getcwd())
+    logFile = open(logFileName, "a", buffering=1)
+    logFile.write("\n\n\n################################\n")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("config")
+    for key, value in GeneralParams(sys.argv[2]).params.items():
+        parser.add_argument("--%s" % key, default=value, type=type(value))
+    parser.add_argument("--resume", action="store_true", help="Continue the GA from results/checkpoint.npz")
+    gParams = parser.parse_args()
+    try:
+        pool = make_executor(gParams)
+    except RuntimeError as err:
+        print("%s. Aborting..." % err)
+        exit(1)
+    try:
+        fit(sys.argv[1], gParams, executor=pool, logFile=logFile, quiet=False, resume=gParams.resume)
+    except RuntimeError as err:
+        print("\n%s. Aborting..." % err)
+        logFile.write("\n%s. Aborting...\n" % err)
+        pool.terminate()
+        exit(1)
+    pool.close()
+    pool.join()
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+
+""" Fake batch scheduler to test the scheduler executor on one machine.
+
+    ./fake_scheduler.py submit --array 0-9 script.sh   prints "Submitted batch job <id>"
+    ./fake_scheduler.py status <id>                    prints "RUNNING" while the job runs
+    ./fake_scheduler.py cancel <id>
+
+Elements of the array are run as 'script.sh' processes with the
+FAKE_ARRAY_TASK_ID (and SLURM_ARRAY_TASK_ID) environment variable, at most
+FAKE_SCHEDULER_SLOTS (the number of CPUs by default) at once. The state is
+kept in FAKE_SCHEDULER_DIR (/tmp/fake_scheduler_<user> by default).
+"""
+
+import argparse
+import getpass
+import os
+import signal
+import subprocess
+import sys
+import time
+from os import path
+
+stateDir = os.environ.get("FAKE_SCHEDULER_DIR", "/tmp/fake_scheduler_%s" % getpass.getuser())
+
+
+def new_job_id():
+    if not path.exists(stateDir):
+        os.makedirs(stateDir, exist_ok=True)
+    jobId = 1
+    while True:
+        try:
+            # the file is created atomically, so concurrent submits get different ids
+            os.close(os.open(path.join(stateDir, "%i.pid" % jobId), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return jobId
+        except FileExistsError:
+            jobId += 1
+
+
+def run_array(first, last, script, slots):
+    """ Runs the elements of the array (in the background process) """
+    running = []
+    for element in range(first, last + 1):
+        while len(running) >= slots:
+            running = [proc for proc in running if proc.poll() is None]
+            time.sleep(0.05)
+        env = dict(os.environ, FAKE_ARRAY_TASK_ID=str(element), SLURM_ARRAY_TASK_ID=str(element))
+        running.append(subprocess.Popen([script], env=env))
+    for proc in running:
+        proc.wait()
+
+
+def running_pid(jobId):
+    """ pid of the job process if it is running """
+    try:
+        pid = int(open(path.join(stateDir, "%s.pid" % jobId)).read())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    if path.exists(path.join(stateDir, "%s.done" % jobId)):
+        # finished, but not reaped yet
+        return None
+    return pid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake batch scheduler running array jobs locally")
+    parser.add_argument("command", choices=["submit", "status", "cancel", "run"])
+    parser.add_argument("args", nargs="*")
+    parser.add_argument("--array", default="0-0", help="submit: range of element indices")
+    args = parser.parse_intermixed_args()
+
+    if args.command == "submit":
+        first, last = [int(v) for v in args.array.split("-")]
+        jobId = new_job_id()
+        slots = int(os.environ.get("FAKE_SCHEDULER_SLOTS", os.cpu_count()))
+        log = open(path.join(stateDir, "%i.out" % jobId), "w")
+        proc = subprocess.Popen([sys.executable, path.abspath(__file__), "run", str(jobId), str(first), str(last),
+                                 path.abspath(args.args[0]), str(slots)],
+                                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        open(path.join(stateDir, "%i.pid" % jobId), "w").write(str(proc.pid))
+        print("Submitted batch job %i" % jobId)
+    elif args.command == "run":
+        jobId, first, last, script, slots = args.args
+        run_array(int(first), int(last), script, int(slots))
+        open(path.join(stateDir, "%s.done" % jobId), "w").close()
+    elif args.command == "status":
+        if running_pid(args.args[0]) is not None:
+            print("%s RUNNING" % args.args[0])
+    else:
+        pid = running_pid(args.args[0])
+        if pid is not None:
+            os.killpg(pid, signal.SIGTERM)
@@ -0,0 +1,405 @@
+#! /usr/bin/env python
+
+""" Fit daemon: keeps a warm pool of imfit workers and runs fit jobs
+submitted over a Unix socket (workdir/daemon.sock by default, accessible
+to the owner only) or, with --tcp, an unauthenticated local HTTP endpoint
+(127.0.0.1).
+
+    ./fit_daemon.py serve config.dat
+    ./fit_daemon.py submit model.imfit --priority 5 --cores 4 --set fitsToFit=gal.fits --set PSF=psf.fits
+    ./fit_daemon.py status [id]
+    ./fit_daemon.py cancel id
+
+Jobs can override the fit parameters of overridableParams only (not the
+imfit path, its extra options or the executor), their config files have to
+be in the directory of the daemon config and their results directories
+in the work directory.
+
+HTTP API (JSON bodies and answers):
+
+    POST   /jobs       submit a job: {"model": ..., "config": ..., "overrides": {...},
+                       "priority": 0, "cores": 4, "resultsDir": ...}, returns {"id": ...}
+    GET    /jobs       list of the jobs
+    GET    /jobs/<id>  state, progress and result of the job
+    DELETE /jobs/<id>  cancel the job
+"""
+
+import argparse
+import datetime
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import re
+from os import path
+from multiprocessing import Pool
+
+from libs.read_input import GeneralParams, parse_param_value
+from cluster_imfit import fit, FitCancelled
+
+# Parameters which are file names
+fileParams = ["fitsToFit", "PSF", "mask", "weight", "initSeedFile", "genTextFile"]
+# Parameters which jobs can override. The others (imfitPath, addImfitStr,
+# executor and sched*) make the commands run by the daemon
+overridableParams = ["fitsToFit", "PSF", "mask", "weight", "readNoise", "gain",
+                     "zeroGenSize", "popSize", "selectNbest", "addNew", "maxGenNumber", "fTol", "fSpan",
+                     "saveGens", "runLM", "numOfLM", "LMCores", "lmMinDistance", "lmRace", "lmRaceMargin",
+                     "lmRaceMinIter", "lmRacePeriod", "lmEarlyStart", "lmStaleMargin", "genTextFile", "seed",
+                     "selection", "selectionPressure", "crossover", "mutation", "optimizer", "memeticPeriod",
+                     "memeticNum", "memeticFTol", "surrogate", "surrogateFraction", "surrogateExplore",
+                     "initMethod", "initSigma", "initSeedFile", "initSeedFraction", "tieCentres", "geneEncoding",
+                     "mutationControl", "maxRestarts", "restartElite", "restartGrowth", "minDiversity", "maxEvaluations", "niching",
+                     "nicheRadius", "bootstrapIter", "bootstrapChunks", "checkpoint"]
+# File names which can be put into imfit command lines
+safeFileNameRe = re.compile(r"^[\w./+-]+$")
+
+
+def inside(directory, fileName):
+    """ Checks if the file is in the directory (or its subdirectories) """
+    directory = path.realpath(directory)
+    return path.commonpath([directory, path.realpath(fileName)]) == directory
+
+
+class FitRequest(object):
+    """ A job of the daemon """
+    def __init__(self, ident, model, config, overrides, priority, cores, resultsDir):
+        self.ident = ident
+        self.model = model
+        self.config = config
+        self.overrides = overrides
+        self.priority = priority
+        self.cores = cores
+        self.resultsDir = resultsDir
+        self.state = "queued"
+        self.progress = {}
+        self.cancelled = threading.Event()
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        info = {"id": self.ident, "model": self.model, "state": self.state, "priority": self.priority,
+                "cores": self.cores, "resultsDir": self.resultsDir, "progress": dict(self.progress),
+                "submitted": self.submitted, "started": self.started, "finished": self.finished}
+        if self.result is not None:
+            info["result"] = {"chisq": self.result.chisq, "values": self.result.values,
+                              "resultFile": self.result.resultFile, "badParams": self.result.badParams,
+                              "generations": int(self.result.generations),
+                              "evaluations": int(self.result.evaluations),
+                              "timeSpent": self.result.timeSpent}
+        if self.error is not None:
+            info["error"] = self.error
+        return info
+
+
+class FitDaemon(object):
+    """ Job queue over one pool of numOfCores imfit workers. Jobs are
+    started in the order of their priority (higher first, then in the
+    order of submission) while the sum of core budgets of the running
+    jobs fits into numOfCores; a job which does not fit blocks the
+    queue, so that big jobs are not starved by small ones. 'onFinish'
+    is called with every finished (or failed, or cancelled) job. """
+    def __init__(self, config, workDir, onFinish=None):
+        self.config = config
+        self.onFinish = onFinish
+        self.defaults = GeneralParams(config).params
+        self.numOfCores = self.defaults["numOfCores"]
+        self.workDir = workDir
+        self.pool = Pool(self.numOfCores)
+        self.jobs = {}
+        self.queue = []
+        self.usedCores = 0
+        self.lastIdent = 0
+        self.lock = threading.Condition()
+        self.stopping = False
+        self.scheduler = threading.Thread(target=self.schedule, daemon=True)
+        self.scheduler.start()
+
+    def submit(self, request):
+        """ Queues the job described by the dictionary of the request,
+        returns its ident """
+        if "model" not in request:
+            raise ValueError("'model' is not given")
+        cores = int(request.get("cores", self.numOfCores))
+        if not (1 <= cores <= self.numOfCores):
+            raise ValueError("cores has to be between 1 and %i" % self.numOfCores)
+        overrides = dict(request.get("overrides", {}))
+        unknown = [key for key in overrides if key not in self.defaults]
+        if unknown:
+            raise ValueError("unknown parameters: %s" % ", ".join(unknown))
+        forbidden = [key for key in overrides if key not in overridableParams]
+        if forbidden:
+            raise ValueError("parameters cannot be overridden: %s" % ", ".join(forbidden))
+        for key, value in overrides.items():
+            if isinstance(value, str):
+                overrides[key] = parse_param_value(self.defaults[key], value)
+            if (key in fileParams) and isinstance(overrides[key], str) and \
+                    not safeFileNameRe.match(overrides[key]):
+                raise ValueError("bad file name of %s: '%s'" % (key, overrides[key]))
+        genTextFile = overrides.get("genTextFile")
+        if (genTextFile is not None) and ((path.isabs(genTextFile) and not inside(self.workDir, genTextFile)) or
+                                          (".." in genTextFile.split(os.sep))):
+            raise ValueError("genTextFile has to be in %s" % self.workDir)
+        config = path.abspath(request.get("config", self.config))
+        if path.dirname(path.realpath(config)) != path.dirname(path.realpath(self.config)):
+            raise ValueError("config has to be in %s" % path.dirname(self.config))
+        resultsDir = request.get("resultsDir")
+        if resultsDir is not None:
+            resultsDir = path.abspath(resultsDir)
+            if (not inside(self.workDir, resultsDir)) or (not safeFileNameRe.match(resultsDir)):
+                raise ValueError("resultsDir has to be in %s" % self.workDir)
+        with self.lock:
+            self.lastIdent += 1
+            ident = self.lastIdent
+            if resultsDir is None:
+                resultsDir = path.join(self.workDir, "job_%i" % ident, "results")
+            job = FitRequest(ident, path.abspath(request["model"]), config,
+                             overrides, int(request.get("priority", 0)), cores, resultsDir)
+            self.jobs[ident] = job
+            self.queue.append(job)
+            self.queue.sort(key=lambda j: (-j.priority, j.ident))
+            self.lock.notify_all()
+        return ident
+
+    def cancel(self, ident):
+        """ Cancels the job: a queued job is removed from the queue, a
+        running one is stopped at the next generation """
+        with self.lock:
+            job = self.jobs[ident]
+            if job.state == "queued":
+                self.queue.remove(job)
+                job.state = "cancelled"
+                job.finished = time.time()
+                if self.onFinish is not None:
+                    self.onFinish(job)
+            elif job.state == "running":
+                job.cancelled.set()
+            self.lock.notify_all()
+            return job.state
+
+    def schedule(self):
+        """ Starts the queued jobs when there are free cores """
+        with self.lock:
+            while not self.stopping:
+                if self.queue and (self.usedCores + self.queue[0].cores <= self.numOfCores):
+                    job = self.queue.pop(0)
+                    job.state = "running"
+                    job.started = time.time()
+                    self.usedCores += job.cores
+                    threading.Thread(target=self.run, args=(job,), daemon=True).start()
+                else:
+                    self.lock.wait()
+
+    def run(self, job):
+        jobDir = path.dirname(job.resultsDir)
+        if not os.path.exists(job.resultsDir):
+            os.makedirs(job.resultsDir)
+        logFile = open(path.join(jobDir, "log.dat"), "a", buffering=1)
+        logFile.write("\n\n\n################################\n")
+        try:
+            # the daemon config is parsed once
+            config = self.defaults if job.config == self.config else GeneralParams(job.config).params
+            job.result = fit(job.model, config, executor=self.pool, resultsDir=job.resultsDir, logFile=logFile,
+                             cores=job.cores, progress=job.progress, cancelled=job.cancelled, **job.overrides)
+            state = "done"
+        except FitCancelled:
+            state = "cancelled"
+        except Exception as err:
+            logFile.write("\n%s. Aborting...\n" % err)
+            job.error = traceback.format_exception_only(type(err), err)[-1].strip()
+            state = "failed"
+        logFile.close()
+        with self.lock:
+            job.state = state
+            job.finished = time.time()
+            self.usedCores -= job.cores
+            self.lock.notify_all()
+        if self.onFinish is not None:
+            self.onFinish(job)
+
+    def status(self, ident=None):
+        with self.lock:
+            if ident is None:
+                return [job.to_dict() for job in sorted(self.jobs.values(), key=lambda j: j.ident)]
+            return self.jobs[ident].to_dict()
+
+    def shutdown(self):
+        with self.lock:
+            self.stopping = True
+            for job in self.jobs.values():
+                job.cancelled.set()
+            self.lock.notify_all()
+        self.pool.terminate()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """ JSON API of the daemon (see the module docstring) """
+    def address_string(self):
+        # client address of a Unix socket is not a (host, port) pair
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def answer(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job_ident(self):
+        parts = self.path.strip("/").split("/")
+        if (len(parts) == 2) and (parts[0] == "jobs") and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/jobs":
+            self.answer(200, self.server.fitDaemon.status())
+            return
+        ident = self.job_ident()
+        if ident not in self.server.fitDaemon.jobs:
+            self.answer(404, {"error": "no such job"})
+            return
+        self.answer(200, self.server.fitDaemon.status(ident))
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.answer(404, {"error": "unknown path"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            ident = self.server.fitDaemon.submit(request)
+        except (ValueError, TypeError) as err:
+            self.answer(400, {"error": str(err)})
+            return
+        self.answer(201, {"id": ident})
+
+    def do_DELETE(self):
+        ident = self.job_ident()
+        if ident not in self.server.fitDaemon.jobs:
+            self.answer(404, {"error": "no such job"})
+            return
+        self.answer(200, {"id": ident, "state": self.server.fitDaemon.cancel(ident)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class UnixConnection(http.client.HTTPConnection):
+    """ HTTP connection over a Unix socket """
+    def __init__(self, socketPath):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socketPath)
+
+
+def request(args, method, url, data=None):
+    """ Sends a request to the daemon, returns the decoded answer """
+    if args.tcp:
+        connection = http.client.HTTPConnection("127.0.0.1", args.port)
+    else:
+        connection = UnixConnection(args.socket)
+    body = json.dumps(data) if data is not None else None
+    connection.request(method, url, body=body, headers={"Content-Type": "application/json"})
+    answer = json.loads(connection.getresponse().read())
+    connection.close()
+    return answer
+
+
+def serve(args):
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+    daemon = FitDaemon(path.abspath(args.config), path.abspath(args.workdir))
+    if not args.tcp:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        # only the owner can connect to the socket
+        oldUmask = os.umask(0o177)
+        try:
+            server = UnixServer(args.socket, RequestHandler)
+        finally:
+            os.umask(oldUmask)
+        where = args.socket
+    else:
+        server = TCPServer(("127.0.0.1", args.port), RequestHandler)
+        where = "http://127.0.0.1:%i (any local user can submit jobs)" % args.port
+    server.fitDaemon = daemon
+    print("Fit daemon with %i cores is listening on %s (started at %s)" % (
+        daemon.numOfCores, where, datetime.datetime.now().strftime("%d.%m.%Y %H:%M")))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    daemon.shutdown()
+    if not args.tcp:
+        os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local daemon running fits over a warm pool of imfit workers")
+    parser.add_argument("command", choices=["serve", "submit", "status", "cancel"])
+    parser.add_argument("args", nargs="*", help="serve: config; submit: model; status, cancel: job id")
+    parser.add_argument("--socket", default=None, help="Unix socket of the daemon (default: workdir/daemon.sock)")
+    parser.add_argument("--tcp", action="store_true",
+                        help="Use an unauthenticated HTTP port on 127.0.0.1 instead of the socket")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the daemon on 127.0.0.1 (with --tcp)")
+    parser.add_argument("--workdir", default="daemon", help="serve: directory for the results of the jobs")
+    parser.add_argument("--config", dest="jobConfig", default=None, help="submit: config file of the job")
+    parser.add_argument("--priority", type=int, default=0, help="submit: priority of the job (higher first)")
+    parser.add_argument("--cores", type=int, default=None, help="submit: number of cores for the job")
+    parser.add_argument("--results", default=None, help="submit: directory for the results of the job")
+    parser.add_argument("--set", action="append", default=[], metavar="PARAM=VALUE",
+                        help="submit: override a parameter of the config")
+    args = parser.parse_args()
+    if args.socket is None:
+        args.socket = path.join(args.workdir, "daemon.sock")
+
+    if args.command == "serve":
+        if len(args.args) != 1:
+            print("Usage: ./fit_daemon.py serve config.dat [--socket path | --tcp --port N]")
+            sys.exit(1)
+        args.config = args.args[0]
+        serve(args)
+        sys.exit(0)
+    if args.command == "submit":
+        if len(args.args) != 1:
+            print("Usage: ./fit_daemon.py submit model.imfit [--set param=value ...]")
+            sys.exit(1)
+        overrides = dict(pair.split("=", 1) for pair in args.set)
+        for key in fileParams:
+            if (key in overrides) and (overrides[key] != "none"):
+                # the daemon may run in another directory
+                overrides[key] = path.abspath(overrides[key])
+        data = {"model": path.abspath(args.args[0]), "priority": args.priority, "overrides": overrides}
+        if args.jobConfig is not None:
+            data["config"] = path.abspath(args.jobConfig)
+        if args.cores is not None:
+            data["cores"] = args.cores
+        if args.results is not None:
+            data["resultsDir"] = path.abspath(args.results)
+        answer = request(args, "POST", "/jobs", data)
+    elif args.command == "status":
+        answer = request(args, "GET", "/jobs/%s" % args.args[0] if args.args else "/jobs")
+    else:
+        answer = request(args, "DELETE", "/jobs/%s" % args.args[0])
+    print(json.dumps(answer, indent=2))
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+
+import numpy as np
+
+
+def read_bootstrap_file(fileName):
+    """ Reads a file saved by imfit --save-bootstrap. Returns the list
+    of column names (taken from the last comment line before the data)
+    and the array of parameter values, one row per bootstrap iteration """
+    names = []
+    rows = []
+    for line in open(fileName):
+        sLine = line.strip()
+        if len(sLine) == 0:
+            continue
+        if sLine.startswith("#"):
+            if not rows:
+                names = sLine[1:].split()
+            continue
+        rows.append([float(v) for v in sLine.split()])
+    return names, np.array(rows, dtype=float).reshape(len(rows), len(names))
+
+
+def merge_bootstrap_files(fileNames, outFile):
+    """ Merges bootstrap tables of several imfit runs into one file.
+    All the tables have to have the same columns. Returns the column
+    names and the merged array of values """
+    allNames = None
+    tables = []
+    for fileName in fileNames:
+        names, values = read_bootstrap_file(fileName)
+        if allNames is None:
+            allNames = names
+        elif names != allNames:
+            raise ValueError("Columns of %s differ from the ones of %s" % (fileName, fileNames[0]))
+        tables.append(values)
+    values = np.concatenate(tables)
+    fout = open(outFile, "w")
+    fout.write("# Bootstrap resampling: %i iterations merged from %i imfit runs\n" % (len(values), len(tables)))
+    fout.write("# %s\n" % ("  ".join(allNames)))
+    for row in values:
+        fout.write("  ".join("%1.6g" % v for v in row) + "\n")
+    fout.close()
+    return allNames, values
+
+
+def save_bootstrap_summary(names, values, outFile, bestValues=None):
+    """ Saves summary statistics of the bootstrap table: mean, standard
+    deviation and the 16th, 50th and 84th percentiles of each column,
+    and the best-fit values if they are given (a list ordered as the
+    columns) """
+    percentiles = np.percentile(values, [16, 50, 84], axis=0)
+    fout = open(outFile, "w")
+    fout.write("# %i bootstrap iterations\n" % len(values))
+    fout.write("# name           best         mean          std          p16          p50          p84\n")
+    for i, name in enumerate(names):
+        best = bestValues[i] if bestValues is not None else np.nan
+        fout.write("%-12s %12.5g %12.5g %12.5g %12.5g %12.5g %12.5g\n" % (name, best, values[:, i].mean(),
+                                                                        values[:, i].std(ddof=1),
+                                                                        percentiles[0, i], percentiles[1, i],
+                                                                        percentiles[2, i]))
+    fout.close()
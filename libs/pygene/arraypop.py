@@ -0,0 +1,948 @@
+"""
+pygene/arraypop.py - Population of Mendelian organisms stored as arrays
+
+The classic Population keeps a list of MendelOrganism objects, each one
+holding a dict of gene pairs. Mating and mutation then copy every gene
+object one by one, which becomes the bottleneck when the fitness
+evaluation itself is fast.
+
+ArrayPopulation keeps the genotypes of all its organisms in a single
+NumPy array of shape (N, 2, G), where N is the number of organisms and
+G is the number of genes in the species' genome. Selection, mendelian
+crossover, phenotype computation and mutation are performed as
+whole-array operations. Organism objects of the species are only
+created to evaluate the fitness and to hand them out to the user, so
+the species' prepare_fitness/fitness methods work unchanged.
+
+Only genomes made of FloatGeneMax genes are supported: the phenotype
+of a gene pair is the greater of the two alleles, and mutation moves
+the allele towards one of the randMin/randMax bounds exactly like
+FloatGene.mutate does.
+
+Alternatively the population can use the real-coded operators of
+pygene.organism (SBX, BLX-alpha or block crossover, polynomial
+mutation). Then
+both alleles of every pair always hold the same value, so the phenotype
+is just this value and the max-of-alleles rule doesn't bias the
+parameters upwards.
+
+Optionally the population keeps a surrogate model of the fitness
+(pygene.surrogate) trained on all the evaluations. Then only the
+children predicted to be the fittest, plus a random exploration quota,
+are evaluated for real; the other children are discarded.
+
+The state of the population can be taken as a dict of NumPy arrays
+(getState) and restored (setState), e.g. to checkpoint a long run.
+"""
+
+import json
+
+import numpy as np
+
+from .gene import FloatGeneMax
+from .organism import MendelOrganism
+from .organism import sbxCrossover, blxCrossover, blockCrossover, polynomialMutation
+from .population import asCompleted
+from .selection import selectPairs
+from .surrogate import RBFSurrogate, rankCorrelation
+from . import sampling
+
+from .xmlio import PGXmlMixin
+
+
+def _makeGene(cls, value):
+    """
+    Creates a gene of the given class with the given value
+    without drawing a random one in the constructor
+    """
+    gene = cls.__new__(cls)
+    gene.value = value
+    return gene
+
+
+class ArrayPopulation(PGXmlMixin):
+    """
+    Represents a population of mendelian organisms whose gene pairs
+    are stored in a NumPy array
+
+    Overridable class variables are the same as in Population:
+
+        - species - MendelOrganism subclass whose genome consists
+          of FloatGeneMax genes
+
+        - initPopulation - size of population to randomly create
+
+        - childCull - cull to this many children after each generation
+
+        - childCount - number of parent pairs to mate in each generation
+          (every pair produces two children)
+
+        - incest - number of best adults to carry over to the children
+
+        - numNewOrganisms - number of random new orgs to add each
+          generation
+
+        - mutants - if mutateAfterMating is False, the proportion
+          of mutated versions of children to add to the child population
+
+        - mutateAfterMating - mutate all progeny
+
+        - selection - name of the parent selection operator
+          from pygene.selection ('sqrt', 'rank', 'tournament' or 'sus')
+
+        - selectionPressure - parameter of the rank and tournament
+          selection operators
+
+        - crossover - 'mendel' (default) for the mendelian crossover,
+          'sbx' or 'blx' for the real-coded crossovers, 'block' for
+          the real-coded crossover exchanging whole linked blocks of
+          genes. Genes named '<block>:<name>' belong to the same block
+          (for imfit models, all parameters of one function)
+
+        - mutation - 'float' (default) for the FloatGene mutation or
+          'polynomial' for the polynomial mutation
+
+        - crossoverEta, blxAlpha, mutationEta - parameters of the
+          real-coded operators (see pygene.organism)
+
+        - mutationControl - 'fixed' (default) keeps the mutation step
+          sizes, 'success' adapts them by the 1/5th success rule: when
+          more than successTarget of the evaluated children are fitter
+          than both their parents, the steps grow by 1/adaptFactor,
+          otherwise they shrink by adaptFactor. The current multiplier of
+          the steps is kept in the mutationScale attribute (it scales
+          mutAmt of the float mutation and 1/(mutationEta+1) of the
+          polynomial one), the success rate of the last generation is kept
+          in successRate
+
+        - successTarget, adaptFactor, minMutationScale,
+          maxMutationScale - parameters of the 'success' control
+
+        - initMethod - how the initial population is drawn: 'uniform'
+          (default, independent random alleles), 'lhs' (Latin hypercube),
+          'sobol' (scrambled Sobol' sequence) or 'gaussian' (normal
+          distribution around initCenter). Organisms of the space-filling
+          designs have both alleles of a pair equal, so their phenotypes
+          are the design points
+
+        - initCenter - dict mapping gene names to the centre values
+          of the 'gaussian' initialisation (missing genes are centred
+          in their range)
+
+        - initSigma - standard deviation of the 'gaussian'
+          initialisation as a fraction of the genes' range
+
+        - initSeeds - list of dicts mapping gene names to values;
+          these organisms are put into the initial population as they are
+          (missing genes are drawn randomly)
+
+        - surrogate - pre-screen children by a surrogate model of
+          the fitness before evaluating them
+
+        - surrogateFraction - proportion of children with the best
+          predicted fitness to evaluate
+
+        - surrogateExplore - proportion of other children, chosen
+          randomly, to evaluate as well
+
+        - niching - 'none' (default), 'sharing' or 'crowding'. With
+          fitness sharing the culling of children ranks them by their
+          fitness multiplied by the niche count (the number of organisms
+          within nicheRadius, weighted by the distance), so crowded
+          basins are thinned out; the fittest organism is always kept.
+          With deterministic crowding every child competes with the
+          closer of its parents and replaces it if it is fitter, so the
+          adults are replaced within their niches (incest is not used)
+
+        - nicheRadius - niche radius: the distance between organisms
+          is the root mean square difference of their phenotypes
+          in normalised coordinates (every gene spans [0, 1])
+
+        - restartGrowth - multiplier of initPopulation, childCount and
+          childCull on every reseed (IPOP-style population increase)
+
+        - seed - seed of the population's random number generator.
+          All random numbers used by the population (initial genes,
+          selection, crossover and mutation) are drawn from it in bulk,
+          so a run with a given seed is reproducible. If None, the
+          generator is seeded from the OS entropy.
+
+    Supports the following python operators:
+
+        - [] - int subscript - returns the ith fittest member
+
+        - len() - number of organisms in the population
+    """
+    # cull to this many children after each generation
+    childCull = 20
+
+    # number of children to create after each generation
+    childCount = 100
+
+    # max number of best parents to mix amongst the kids for
+    # next generation
+    incest = 10
+
+    # number of new random organisms to add each generation
+    numNewOrganisms = 0
+
+    # set to initial population size
+    initPopulation = 10
+
+    # set to species of organism
+    species = MendelOrganism
+
+    # mutate this proportion of organisms
+    mutants = 0.1
+
+    # set this to true to mutate all progeny
+    mutateAfterMating = True
+
+    # parent selection operator and its parameter
+    selection = "sqrt"
+    selectionPressure = 2.0
+
+    # crossover and mutation operators and their parameters
+    crossover = "mendel"
+    mutation = "float"
+    crossoverEta = 15.0
+    blxAlpha = 0.5
+    mutationEta = 20.0
+
+    # adaptation of the mutation step sizes
+    mutationControl = "fixed"
+    successTarget = 0.2
+    adaptFactor = 0.85
+    minMutationScale = 1e-3
+    maxMutationScale = 100.0
+
+    # keep both alleles of every pair equal (set automatically
+    # for the real-coded crossovers)
+    realCoded = False
+
+    # initialisation of the zero generation
+    initMethod = "uniform"
+    initCenter = None
+    initSigma = 0.1
+    initSeeds = ()
+
+    # surrogate pre-screening of the children
+    surrogate = False
+    surrogateFraction = 0.3
+    surrogateExplore = 0.1
+
+    # niching of the replacement
+    niching = "none"
+    nicheRadius = 0.1
+
+    # population growth on reseeding
+    restartGrowth = 2.0
+
+    # seed of the random number generator
+    seed = None
+
+    def __init__(self, **kw):
+        """
+        Create a population of randomly initialised organisms
+
+        Keywords:
+            - init - size of initial population to randomly create.
+              If not given, value comes from self.initPopulation
+            - species - species of organism to create. If not
+              given, value comes from self.species
+            - childCount, childCull, incest, numNewOrganisms, selection,
+              selectionPressure, crossover, mutation, crossoverEta,
+              blxAlpha, mutationEta, mutationControl, successTarget,
+              adaptFactor, minMutationScale, maxMutationScale, initMethod,
+              initCenter, initSigma, initSeeds, surrogate, surrogateFraction,
+              surrogateExplore, niching, nicheRadius, restartGrowth,
+              seed - override the corresponding class variables
+        """
+        for key in ("species", "childCount", "childCull", "incest", "numNewOrganisms",
+                    "selection", "selectionPressure", "crossover", "mutation",
+                    "crossoverEta", "blxAlpha", "mutationEta", "mutationControl",
+                    "successTarget", "adaptFactor", "minMutationScale",
+                    "maxMutationScale", "initMethod", "initCenter",
+                    "initSigma", "initSeeds", "surrogate", "surrogateFraction",
+                    "surrogateExplore", "niching", "nicheRadius", "restartGrowth",
+                    "seed"):
+            if key in kw:
+                setattr(self, key, kw[key])
+        if "init" in kw:
+            self.initPopulation = kw["init"]
+
+        self.rng = np.random.default_rng(self.seed)
+        if self.crossover not in ("mendel", "sbx", "blx", "block"):
+            raise ValueError("Unknown crossover type '%s'" % self.crossover)
+        if self.mutation not in ("float", "polynomial"):
+            raise ValueError("Unknown mutation type '%s'" % self.mutation)
+        if self.mutationControl not in ("fixed", "success"):
+            raise ValueError("Unknown mutation control '%s'" % self.mutationControl)
+        if self.niching not in ("none", "sharing", "crowding"):
+            raise ValueError("Unknown niching type '%s'" % self.niching)
+        if self.initMethod not in sampling.methods:
+            raise ValueError("Unknown initialisation method '%s'" % self.initMethod)
+        # real-coded organisms are homozygous
+        self.realCoded = self.realCoded or self.crossover != "mendel"
+
+        # Gene names are stored in a fixed order, so that the i-th
+        # column of the allele array always corresponds to the same gene
+        self.geneNames = sorted(self.species.genome.keys())
+        self.geneClasses = [self.species.genome[name] for name in self.geneNames]
+        for name, cls in zip(self.geneNames, self.geneClasses):
+            if not issubclass(cls, FloatGeneMax):
+                raise TypeError("ArrayPopulation supports only FloatGeneMax genes (gene '%s')" % name)
+        self.randMin = np.array([cls.randMin for cls in self.geneClasses], dtype=float)
+        self.randMax = np.array([cls.randMax for cls in self.geneClasses], dtype=float)
+        self.mutProb = np.array([cls.mutProb for cls in self.geneClasses], dtype=float)
+        self.mutAmt = np.array([cls.mutAmt for cls in self.geneClasses], dtype=float)
+        # block index of every gene for the block crossover
+        self.geneBlocks = np.unique([name.split(":")[0] for name in self.geneNames], return_inverse=True)[1]
+
+        self.surrogateModel = RBFSurrogate(self.randMin, self.randMax) if self.surrogate else None
+        # rank correlation of the predicted and real fitness of the evaluated
+        # children and the number of evaluations saved in the last generation
+        self.surrogateCorrelation = np.nan
+        self.savedEvaluations = 0
+        self.mutationScale = 1.0
+        self.successRate = np.nan
+        # number of fitness evaluations and reseeds done so far
+        self.evaluations = 0
+        self.restarts = 0
+
+        self.alleles = np.empty((0, 2, len(self.geneNames)))
+        self.fitnesses = np.empty(0)
+        self.organisms = []
+        self.sorted = False
+        self.add(self.initialAlleles(self.initPopulation))
+
+    def randomAlleles(self, count):
+        """
+        Returns an array of 'count' random gene pairs. Genes having
+        a fixed value get this value instead of a random one.
+        """
+        shape = (count, 2, len(self.geneNames))
+        alleles = self.rng.uniform(self.randMin, self.randMax, size=shape)
+        if self.realCoded:
+            alleles[:, 1] = alleles[:, 0]
+        for i, cls in enumerate(self.geneClasses):
+            if cls.value is not None:
+                alleles[:, :, i] = cls.value
+        return alleles
+
+    def initialAlleles(self, count, useSeeds=True):
+        """
+        Returns an array of 'count' gene pairs for the initial
+        population: the seeds from initSeeds (if useSeeds is True)
+        followed by the points of the initMethod design
+        """
+        seeds = list(self.initSeeds)[:count] if useSeeds else []
+        ngenes = len(self.geneNames)
+        if self.initMethod == "uniform":
+            alleles = self.randomAlleles(count - len(seeds))
+        else:
+            options = {}
+            if self.initMethod == "gaussian":
+                center = np.full(ngenes, 0.5)
+                if self.initCenter is not None:
+                    values = np.array([self.initCenter.get(name, np.nan) for name in self.geneNames], dtype=float)
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        values = (values - self.randMin) / (self.randMax - self.randMin)
+                    known = np.isfinite(values)
+                    center[known] = values[known]
+                options = {"center": center, "sigma": self.initSigma}
+            unit = sampling.methods[self.initMethod](count - len(seeds), ngenes, self.rng, **options)
+            alleles = self.homozygous(self.randMin + unit * (self.randMax - self.randMin))
+        if seeds:
+            randomValues = self.randomAlleles(len(seeds))[:, 0]
+            values = np.array([[seed.get(name, np.nan) for name in self.geneNames] for seed in seeds], dtype=float)
+            values = np.where(np.isfinite(values), values, randomValues)
+            values = np.clip(values, self.randMin, self.randMax)
+            alleles = np.concatenate((self.homozygous(values), alleles))
+        for i, cls in enumerate(self.geneClasses):
+            if cls.value is not None:
+                alleles[:, :, i] = cls.value
+        return alleles
+
+    def organism(self, alleles):
+        """
+        Creates an organism of the population's species from
+        an array of gene pairs of shape (2, G)
+        """
+        genes = {}
+        for name, cls, pair in zip(self.geneNames, self.geneClasses, alleles.T.tolist()):
+            genes[name] = (_makeGene(cls, pair[0]), _makeGene(cls, pair[1]))
+        return self.species(**genes)
+
+    def organismAlleles(self, org):
+        """
+        Returns the gene pairs of an organism as an array of shape (2, G)
+        """
+        return np.array([[org.genes[name][0].value for name in self.geneNames],
+                         [org.genes[name][1].value for name in self.geneNames]])
+
+    def add(self, *args):
+        """
+        Add organisms to this population. Arguments can be
+        organisms of the species, other ArrayPopulations or arrays
+        of gene pairs of shape (n, 2, G).
+        """
+        for arg in args:
+            if isinstance(arg, np.ndarray):
+                organisms = [self.organism(a) for a in arg]
+                fitnesses = np.full(len(arg), np.nan)
+                alleles = arg
+            elif isinstance(arg, ArrayPopulation):
+                organisms = list(arg.organisms)
+                fitnesses = arg.fitnesses
+                alleles = arg.alleles
+            elif isinstance(arg, MendelOrganism):
+                organisms = [arg]
+                fitnesses = np.array([np.nan if arg.fitness_cache is None else arg.fitness_cache])
+                alleles = self.organismAlleles(arg)[np.newaxis]
+            else:
+                raise TypeError("can only add organisms, ArrayPopulation or allele arrays")
+            self.alleles = np.concatenate((self.alleles, alleles))
+            self.fitnesses = np.concatenate((self.fitnesses, fitnesses))
+            self.organisms.extend(organisms)
+        self.sorted = False
+
+    @staticmethod
+    def homozygous(values):
+        """
+        Returns an array of gene pairs of shape (n, 2, G) whose both
+        alleles are equal to the given values of shape (n, G)
+        """
+        return np.repeat(values[:, np.newaxis], 2, axis=1)
+
+    def setPhenotype(self, org, phenotype, fitness=None):
+        """
+        Replaces the genes of an organism by the given phenotype values
+        (a dict mapping gene names to values, both alleles of a pair get
+        the value). Genes missing in the dict keep their phenotype.
+        The organism is replaced by a new one with the given fitness (if
+        it is known, e.g. from a local search), otherwise its fitness has
+        to be computed again. If the organism is not in the population
+        anymore, the new one replaces the least fit member (unless it is
+        known to be worse), so the size of the population is kept.
+
+        Returns the new organism.
+        """
+        values = np.array([phenotype.get(name, org[name]) for name in self.geneNames], dtype=float)
+        alleles = self.homozygous(np.clip(values, self.randMin, self.randMax)[np.newaxis])
+        newOrg = self.organism(alleles[0])
+        if fitness is not None:
+            newOrg.fitness_cache = fitness
+            self.record(alleles, np.array([fitness]))
+        idx = None
+        for i, member in enumerate(self.organisms):
+            if member is org:
+                idx = i
+                break
+        if idx is None:
+            if np.all(np.isnan(self.fitnesses)):
+                idx = len(self) - 1
+            else:
+                idx = int(np.nanargmax(self.fitnesses))
+                if (fitness is not None) and (fitness >= self.fitnesses[idx]):
+                    return newOrg
+        self.alleles[idx] = alleles[0]
+        self.fitnesses[idx] = np.nan if fitness is None else fitness
+        self.organisms[idx] = newOrg
+        self.sorted = False
+        return newOrg
+
+    def phenotypes(self, alleles=None):
+        """
+        Returns the phenotypes (the greater allele of each pair)
+        as an array of shape (N, G)
+        """
+        if alleles is None:
+            alleles = self.alleles
+        return alleles.max(axis=1)
+
+    def mate(self, parents1, parents2):
+        """
+        Mendelian crossover of two arrays of parents of shape
+        (n, 2, G). Every parent is split into two gametes by a random
+        permutation of each of its gene pairs, the gametes of the two
+        parents then form two children. Returns an array of children
+        of shape (2n, 2, G), where the children of one pair are adjacent.
+        """
+        n, _, ngenes = parents1.shape
+        ourSplit, partnerSplit = self.rng.integers(0, 2, size=(2, n, ngenes)).astype(bool)
+        ourGamete1 = np.where(ourSplit, parents1[:, 0], parents1[:, 1])
+        ourGamete2 = np.where(ourSplit, parents1[:, 1], parents1[:, 0])
+        partnerGamete1 = np.where(partnerSplit, parents2[:, 0], parents2[:, 1])
+        partnerGamete2 = np.where(partnerSplit, parents2[:, 1], parents2[:, 0])
+        children = np.empty((2 * n, 2, ngenes))
+        children[0::2, 0] = ourGamete1
+        children[0::2, 1] = partnerGamete2
+        children[1::2, 0] = ourGamete2
+        children[1::2, 1] = partnerGamete1
+        return children
+
+    def breed(self, parents1, parents2):
+        """
+        Crossover of two arrays of parents of shape (n, 2, G) by the
+        population's crossover operator. Returns an array of children
+        of shape (2n, 2, G), where the children of one pair are adjacent.
+        """
+        if not self.realCoded:
+            return self.mate(parents1, parents2)
+        if self.crossover == "sbx":
+            values1, values2 = sbxCrossover(parents1[:, 0], parents2[:, 0], self.randMin, self.randMax,
+                                            self.crossoverEta, self.rng)
+        elif self.crossover == "block":
+            values1, values2 = blockCrossover(parents1[:, 0], parents2[:, 0], self.geneBlocks, self.rng)
+        else:
+            values1, values2 = blxCrossover(parents1[:, 0], parents2[:, 0], self.randMin, self.randMax,
+                                            self.blxAlpha, self.rng)
+        n, _, ngenes = parents1.shape
+        children = np.empty((2 * n, 2, ngenes))
+        children[0::2] = values1[:, np.newaxis]
+        children[1::2] = values2[:, np.newaxis]
+        return children
+
+    def mutate(self, alleles):
+        """
+        Returns mutated copy of an array of gene pairs.
+
+        With the 'float' mutation each allele mutates with probability
+        mutProb of its gene, moving by a random fraction of mutAmt of the
+        distance to randMin or randMax. If the species has mutateOneOnly
+        set, exactly one gene pair of each organism is mutated
+        unconditionally. Real-coded populations keep the first allele's
+        mutation in both alleles.
+
+        With the 'polynomial' mutation each allele (or both alleles
+        together for real-coded populations) mutates with probability
+        mutProb by the polynomial mutation.
+
+        Step sizes of both mutations are scaled by mutationScale.
+        """
+        if self.mutation == "polynomial":
+            eta = max((self.mutationEta + 1.0) / self.mutationScale - 1.0, 0.0)
+            if self.realCoded:
+                values = polynomialMutation(alleles[:, 0], self.randMin, self.randMax,
+                                            eta, self.mutProb, self.rng)
+                return self.homozygous(values)
+            return polynomialMutation(alleles, self.randMin, self.randMax,
+                                      eta, self.mutProb, self.rng)
+        n, _, ngenes = alleles.shape
+        mutDraw, downDraw, amountDraw = self.rng.random((3,) + alleles.shape)
+        if self.species.mutateOneOnly:
+            mask = np.zeros(alleles.shape, dtype=bool)
+            mask[np.arange(n), :, (mutDraw[:, 0, 0] * ngenes).astype(int)] = True
+        else:
+            mask = mutDraw < self.mutProb
+        down = downDraw < 0.5
+        amount = amountDraw * np.minimum(self.mutAmt * self.mutationScale, 1.0)
+        delta = np.where(down, -amount * (alleles - self.randMin), amount * (self.randMax - alleles))
+        mutated = np.where(mask, alleles + delta, alleles)
+        if self.realCoded:
+            mutated[:, 1] = mutated[:, 0]
+        return mutated
+
+    def adaptMutation(self, fitnesses, parentFitnesses):
+        """
+        Updates mutationScale by the 1/5th success rule, given the
+        fitnesses of the evaluated children and the fitnesses of
+        their better parents
+        """
+        self.successRate = np.mean(fitnesses < parentFitnesses) if len(fitnesses) else np.nan
+        if self.mutationControl != "success" or np.isnan(self.successRate):
+            return
+        if self.successRate > self.successTarget:
+            self.mutationScale /= self.adaptFactor
+        else:
+            self.mutationScale *= self.adaptFactor
+        self.mutationScale = min(max(self.mutationScale, self.minMutationScale), self.maxMutationScale)
+
+    def selectParents(self, npairs):
+        """
+        Selects 'npairs' pairs of distinct parents among the sorted
+        adults using the population's selection operator (see
+        pygene.selection). Returns two arrays of indices.
+        """
+        return selectPairs(self.fitnesses, npairs, self.rng,
+                           self.selection, self.selectionPressure)
+
+    def evaluate(self, organisms):
+        """
+        Computes fitness for a list of organisms and returns it as an
+        array. The prepare_fitness method is called on all the organisms
+        without cached fitness before any of the results are requested,
+        so the species can evaluate them in parallel, and the results
+        are collected in the order the computations finish.
+        """
+        fitnesses = np.empty(len(organisms))
+        for idx, fitness in asCompleted(organisms):
+            fitnesses[idx] = fitness
+        self.evaluations += len(organisms)
+        return fitnesses
+
+    def record(self, alleles, fitnesses):
+        """
+        Stores evaluated gene pairs in the training set of the
+        surrogate model, if the population has one
+        """
+        if self.surrogateModel is not None:
+            self.surrogateModel.add(self.phenotypes(alleles), fitnesses)
+
+    def evaluateAlleles(self, alleles):
+        """
+        Creates organisms from an array of gene pairs of shape (n, 2, G)
+        and evaluates them. Returns the list of organisms and the
+        array of their fitness values.
+        """
+        organisms = [self.organism(a) for a in alleles]
+        fitnesses = self.evaluate(organisms)
+        self.record(alleles, fitnesses)
+        return organisms, fitnesses
+
+    def prescreen(self, children):
+        """
+        Predicts fitness of the children by the surrogate model and
+        returns the indices of the children to evaluate for real: the
+        surrogateFraction of the best predicted ones plus the
+        surrogateExplore of random other ones. At least childCull
+        children are chosen (more of the best predicted ones are taken
+        if needed), so that the culling has enough of them. Also returns
+        the predicted fitness of the chosen children.
+        """
+        nkids = len(children)
+        predicted = self.surrogateModel.predict(self.phenotypes(children))
+        order = np.argsort(predicted, kind="stable")
+        nbest = int(np.ceil(self.surrogateFraction * nkids))
+        nexplore = min(int(np.ceil(self.surrogateExplore * nkids)), nkids - nbest)
+        nbest = max(nbest, min(self.childCull, nkids) - nexplore)
+        explore = self.rng.choice(order[nbest:], size=nexplore, replace=False)
+        chosen = np.sort(np.concatenate((order[:nbest], explore)))
+        return chosen, predicted[chosen]
+
+    def _take(self, indices):
+        """
+        Leaves only the organisms with given indices in the population
+        """
+        self.alleles = self.alleles[indices]
+        self.fitnesses = self.fitnesses[indices]
+        self.organisms = [self.organisms[i] for i in indices]
+
+    @staticmethod
+    def fittest(fitnesses, count):
+        """
+        Returns indices of the 'count' best values of a fitness array,
+        fittest first. Only these values get sorted, the rest are
+        separated from them by a partial selection.
+        """
+        if count >= len(fitnesses):
+            return np.argsort(fitnesses, kind="stable")
+        best = np.argpartition(fitnesses, count - 1)[:count]
+        return best[np.argsort(fitnesses[best], kind="stable")]
+
+    def sort(self):
+        """
+        Sorts this population in order of fitness, with the fittest
+        first. Fitness is computed for organisms which don't have it yet.
+        """
+        if self.sorted:
+            return
+        unknown = np.flatnonzero(np.isnan(self.fitnesses))
+        if len(unknown) > 0:
+            self.fitnesses[unknown] = self.evaluate([self.organisms[i] for i in unknown])
+            self.record(self.alleles[unknown], self.fitnesses[unknown])
+        self._take(np.argsort(self.fitnesses, kind="stable"))
+        self.sorted = True
+
+    def gen(self, nfittest=None, nchildren=None):
+        """
+        Executes a generation of the population.
+
+        This consists of:
+            - producing 'nchildren' pairs of children, parented by members
+              randomly selected with preference for the fittest
+            - culling the children to the fittest 'nfittest' members
+            - killing off the parents, and replacing them with the
+              children
+        """
+        if not nfittest:
+            nfittest = self.childCull
+        if not nchildren:
+            nchildren = self.childCount
+
+        # add in some new random organisms, if required
+        if self.numNewOrganisms:
+            self.add(self.randomAlleles(self.numNewOrganisms))
+
+        self.sort()
+        idx1, idx2 = self.selectParents(nchildren)
+        children = self.breed(self.alleles[idx1], self.alleles[idx2])
+        if self.mutateAfterMating:
+            children = self.mutate(children)
+        # fitness of the better parent of every child
+        parentFitnesses = np.repeat(np.minimum(self.fitnesses[idx1], self.fitnesses[idx2]), 2)
+        parents1, parents2 = np.repeat(idx1, 2), np.repeat(idx2, 2)
+
+        if (self.surrogateModel is not None) and self.surrogateModel.ready():
+            chosen, predicted = self.prescreen(children)
+            self.savedEvaluations = len(children) - len(chosen)
+            children = children[chosen]
+            parentFitnesses = parentFitnesses[chosen]
+            parents1, parents2 = parents1[chosen], parents2[chosen]
+            organisms, fitnesses = self.evaluateAlleles(children)
+            self.surrogateCorrelation = rankCorrelation(predicted, fitnesses)
+        else:
+            organisms, fitnesses = self.evaluateAlleles(children)
+        self.adaptMutation(fitnesses, parentFitnesses)
+
+        if self.niching == "crowding":
+            # the children replace their parents, so the adults stay
+            children, organisms, fitnesses = self.crowd(children, organisms, fitnesses, parents1, parents2)
+        elif self.incest:
+            # if incestuous, add in best adults
+            children = np.concatenate((children, self.alleles[:self.incest]))
+            organisms.extend(self.organisms[:self.incest])
+            fitnesses = np.concatenate((fitnesses, self.fitnesses[:self.incest]))
+
+        if not self.mutateAfterMating:
+            # add in some mutants, a proportion of the children
+            # with a bias toward the fittest
+            order = np.argsort(fitnesses, kind="stable")
+            nkids = len(order)
+            numMutants = int(nkids * self.mutants)
+            idx = np.sqrt(self.rng.integers(0, nkids * nkids, size=numMutants)).astype(int)
+            mutants = self.mutate(children[order[(-idx) % nkids]])
+            mutantOrganisms, mutantFitnesses = self.evaluateAlleles(mutants)
+            children = np.concatenate((children, mutants))
+            fitnesses = np.concatenate((fitnesses, mutantFitnesses))
+            organisms.extend(mutantOrganisms)
+
+        if self.niching == "sharing":
+            best = self.sharedFittest(children, fitnesses, nfittest)
+        else:
+            best = self.fittest(fitnesses, nfittest)
+        self.alleles = children[best]
+        self.fitnesses = fitnesses[best]
+        self.organisms = [organisms[i] for i in best]
+        self.sorted = True
+
+    def normalised(self, alleles=None):
+        """
+        Phenotypes in normalised coordinates, where every gene spans
+        [0, 1] (genes with a fixed value are 0)
+        """
+        span = self.randMax - self.randMin
+        return (self.phenotypes(alleles) - self.randMin) / np.where(span > 0, span, 1.0)
+
+    def distances(self, points1, points2):
+        """
+        Matrix of the distances between two arrays of normalised
+        phenotypes: the root mean square difference of the genes
+        """
+        diff = points1[:, np.newaxis, :] - points2[np.newaxis, :, :]
+        return np.sqrt(np.mean(diff ** 2, axis=2))
+
+    def geneSpread(self):
+        """
+        Standard deviation of every gene's phenotype relative
+        to the gene's range
+        """
+        return self.normalised().std(axis=0)
+
+    def meanDistance(self):
+        """
+        Mean pairwise distance between the organisms
+        """
+        npop = len(self)
+        if npop < 2:
+            return 0.0
+        points = self.normalised()
+        return float(self.distances(points, points).sum() / (npop * (npop - 1)))
+
+    def diversity(self):
+        """
+        Genotype diversity of the population: the standard deviation
+        of the phenotypes relative to the genes' range, averaged over
+        the genes which are not fixed
+        """
+        free = self.randMax > self.randMin
+        if len(self) < 2 or not np.any(free):
+            return 0.0
+        return float(np.mean(self.geneSpread()[free]))
+
+    def crowd(self, children, organisms, fitnesses, parents1, parents2):
+        """
+        Deterministic crowding: every child is matched to the closer of
+        its parents (indices of the adults) and the fittest child matched
+        to an adult replaces it if it is fitter than the adult. Returns
+        the arrays of gene pairs, the list of organisms and the fitness
+        values of the adults after the replacement.
+        """
+        adults = self.normalised()
+        points = self.normalised(children)
+        dist1 = np.sqrt(np.mean((points - adults[parents1]) ** 2, axis=1))
+        dist2 = np.sqrt(np.mean((points - adults[parents2]) ** 2, axis=1))
+        target = np.where(dist1 <= dist2, parents1, parents2)
+        # the fittest child of every target is the first one in this order
+        order = np.lexsort((fitnesses, target))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = target[order][1:] != target[order][:-1]
+        winners = order[first]
+        winners = winners[fitnesses[winners] < self.fitnesses[target[winners]]]
+        alleles = self.alleles.copy()
+        newFitnesses = self.fitnesses.copy()
+        newOrganisms = list(self.organisms)
+        alleles[target[winners]] = children[winners]
+        newFitnesses[target[winners]] = fitnesses[winners]
+        for i in winners:
+            newOrganisms[target[i]] = organisms[i]
+        return alleles, newOrganisms, newFitnesses
+
+    def sharedFittest(self, alleles, fitnesses, count):
+        """
+        Returns indices of 'count' organisms with the best shared
+        fitness (fitness times the niche count, triangular sharing
+        function of radius nicheRadius), ordered by their fitness.
+        The fittest organism is always among them.
+        """
+        points = self.normalised(alleles)
+        sharing = np.maximum(1.0 - self.distances(points, points) / self.nicheRadius, 0.0)
+        shared = fitnesses * sharing.sum(axis=1)
+        best = self.fittest(shared, count)
+        bestRaw = self.fittest(fitnesses, 1)
+        if bestRaw[0] not in best:
+            best[-1] = bestRaw[0]
+        return best[np.argsort(fitnesses[best], kind="stable")]
+
+    def nicheLeaders(self, count, radius=None):
+        """
+        Leader clustering of the population: goes through the organisms
+        from the fittest one and takes an organism as the leader of a new
+        cluster if it is more than 'radius' (nicheRadius by default) away
+        from all the leaders taken so far. Returns up to 'count' leaders,
+        fittest first; organisms close to a leader are skipped, so there
+        can be fewer of them.
+        """
+        if radius is None:
+            radius = self.nicheRadius
+        self.sort()
+        points = self.normalised()
+        leaders = []
+        for i in range(len(self)):
+            if len(leaders) == count:
+                break
+            if not leaders or self.distances(points[i:i+1], points[leaders]).min() > radius:
+                leaders.append(i)
+        return [self.organisms[i] for i in leaders]
+
+    def reseed(self, nelite):
+        """
+        Restarts a stagnated population: keeps the 'nelite' fittest
+        organisms, grows the population sizes by restartGrowth and
+        fills the rest of the new initial population by the initMethod
+        design. The mutation step control is reset.
+        """
+        self.sort()
+        self._take(np.arange(min(nelite, len(self))))
+        self.initPopulation = int(round(self.initPopulation * self.restartGrowth))
+        self.childCount = int(round(self.childCount * self.restartGrowth))
+        self.childCull = int(round(self.childCull * self.restartGrowth))
+        self.add(self.initialAlleles(max(self.initPopulation - len(self), 0), useSeeds=False))
+        self.mutationScale = 1.0
+        self.restarts += 1
+
+    def getState(self):
+        """
+        Returns the state of the population as a dictionary of NumPy
+        arrays (to be saved by np.savez): gene pairs and fitness of
+        the organisms, state of the random generator, population sizes,
+        counters, mutation step control and the surrogate training set
+        """
+        state = {"geneNames": np.array(self.geneNames),
+                 "alleles": self.alleles,
+                 "fitnesses": self.fitnesses,
+                 "rngState": np.array(json.dumps(self.rng.bit_generator.state)),
+                 "counters": np.array([self.initPopulation, self.childCount, self.childCull,
+                                       self.evaluations, self.restarts, self.savedEvaluations]),
+                 "mutationControl": np.array([self.mutationScale, self.successRate, self.surrogateCorrelation])}
+        if self.surrogateModel is not None:
+            state["surrogatePoints"] = self.surrogateModel.points
+            state["surrogateValues"] = self.surrogateModel.values
+        return state
+
+    def setState(self, state):
+        """
+        Restores the state returned by getState. The organisms are
+        created again with their fitness cached, so they are not
+        evaluated. The population has to have the same genes.
+        """
+        if list(state["geneNames"]) != self.geneNames:
+            raise ValueError("The state is of a population with other genes")
+        self.rng.bit_generator.state = json.loads(str(state["rngState"]))
+        (self.initPopulation, self.childCount, self.childCull,
+         self.evaluations, self.restarts, self.savedEvaluations) = [int(v) for v in state["counters"]]
+        self.mutationScale, self.successRate, self.surrogateCorrelation = [float(v) for v in state["mutationControl"]]
+        if (self.surrogateModel is not None) and ("surrogatePoints" in state):
+            self.surrogateModel.points = np.array(state["surrogatePoints"])
+            self.surrogateModel.values = np.array(state["surrogateValues"])
+            self.surrogateModel.model = None
+        self.alleles = np.array(state["alleles"])
+        self.fitnesses = np.array(state["fitnesses"])
+        self.organisms = [self.organism(a) for a in self.alleles]
+        for org, fitness in zip(self.organisms, self.fitnesses):
+            if not np.isnan(fitness):
+                org.fitness_cache = fitness
+        self.sorted = False
+
+    def __repr__(self):
+        """
+        crude human-readable dump of population's members
+        """
+        return str(self.organisms)
+
+    def __getitem__(self, n):
+        """
+        Return the nth member of this population,
+        which we guarantee to be sorted in order from
+        fittest first
+        """
+        self.sort()
+        return self.organisms[n]
+
+    def __len__(self):
+        """
+        return the number of organisms in this population
+        """
+        return len(self.organisms)
+
+    def fitness(self):
+        """
+        returns the average fitness value for the population
+        """
+        self.sort()
+        return self.fitnesses.mean()
+
+    def best(self):
+        """
+        returns the fittest member of the population
+        """
+        self.sort()
+        return self.organisms[0]
+
+    def xmlDumpSelf(self, doc, parent):
+        """
+        Writes out the contents of this population
+        into the xml tree
+        """
+        pop = doc.createElement("population")
+        parent.appendChild(pop)
+
+        pop.setAttribute("class", self.__class__.__name__)
+        pop.setAttribute("module", self.__class__.__module__)
+
+        pop.setAttribute("childCull", str(self.childCull))
+        pop.setAttribute("childCount", str(self.childCount))
+
+        for org in self.organisms:
+            org.xmlDumpSelf(doc, pop)
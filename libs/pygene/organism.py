@@ -14,10 +14,17 @@ Subclasses of Organism must override the following methods:
 
 Refer to module pygene.prog for organism classes for genetic
 programming.
+
+Real-coded operators for continuous genes (simulated binary crossover,
+BLX-alpha crossover and polynomial mutation) are implemented as
+functions working on whole arrays of gene values, as used by
+pygene.arraypop.ArrayPopulation.
 """
 
 from random import random, randrange, choice
 
+import numpy as np
+
 from .gene import BaseGene, rndPair
 from .gamete import Gamete
 
@@ -82,6 +89,15 @@ class BaseOrganism(PGXmlMixin):
         """
         pass
 
+    def fitnessReady(self):
+        """
+        Returns True if 'fitness' can be called without waiting for
+        a computation started by 'prepare_fitness'. Organisms computing
+        the fitness in parallel should override this method. By default
+        the fitness is always considered ready.
+        """
+        return True
+
     def get_fitness(self):
         """
         Return fitness from the cache, and if needed - calculate it.
@@ -688,3 +704,91 @@ class MendelOrganism(BaseOrganism):
             #    )
             for gene in pair:
                 gene.xmlDumpSelf(doc, pairtag)
+
+
+def sbxCrossover(values1, values2, randMin, randMax, eta, rng):
+    """
+    Simulated binary crossover (Deb & Agrawal) of two arrays of gene
+    values, bounded to [randMin, randMax]. Larger 'eta' produces
+    children closer to their parents. Every gene is crossed with
+    probability 0.5. Returns two arrays of children values.
+    """
+    crossDraw, betaDraw1, betaDraw2, swapDraw = rng.random((4,) + np.shape(values1))
+    lower = np.minimum(values1, values2)
+    upper = np.maximum(values1, values2)
+    span = upper - lower
+    cross = (crossDraw < 0.5) & (span > 1e-14)
+    span = np.where(cross, span, 1.0)
+    power = 1.0 / (eta + 1.0)
+
+    def betaq(beta, draw):
+        alpha = 2.0 - beta ** -(eta + 1.0)
+        return np.where(draw <= 1.0 / alpha, (draw * alpha) ** power,
+                        (1.0 / np.maximum(2.0 - draw * alpha, 1e-14)) ** power)
+
+    child1 = 0.5 * (lower + upper - betaq(1.0 + 2.0 * (lower - randMin) / span, betaDraw1) * span)
+    child2 = 0.5 * (lower + upper + betaq(1.0 + 2.0 * (randMax - upper) / span, betaDraw2) * span)
+    child1 = np.clip(child1, randMin, randMax)
+    child2 = np.clip(child2, randMin, randMax)
+    swap = swapDraw < 0.5
+    child1, child2 = np.where(swap, child2, child1), np.where(swap, child1, child2)
+    return np.where(cross, child1, values1), np.where(cross, child2, values2)
+
+
+def blxCrossover(values1, values2, randMin, randMax, alpha, rng):
+    """
+    BLX-alpha crossover of two arrays of gene values: children genes are
+    drawn uniformly from the parents' interval extended by 'alpha' of its
+    length on both sides and clipped to [randMin, randMax]. Returns two
+    arrays of children values.
+    """
+    lower = np.minimum(values1, values2)
+    upper = np.maximum(values1, values2)
+    extent = alpha * (upper - lower)
+    draws = rng.random((2,) + np.shape(values1))
+    children = lower - extent + draws * (upper - lower + 2 * extent)
+    children = np.clip(children, randMin, randMax)
+    return children[0], children[1]
+
+
+def blockCrossover(values1, values2, blocks, rng):
+    """
+    Uniform crossover of linked blocks of genes: every block of the
+    first child comes as a whole from one of the parents, the second
+    child gets the other parent's block. 'blocks' gives the block index
+    of every gene. If there are several blocks, each pair of children
+    gets at least one block from each parent. Returns two arrays of
+    children values.
+    """
+    blocks = np.asarray(blocks)
+    nblocks = blocks.max() + 1
+    n = len(values1)
+    swap = rng.random((n, nblocks)) < 0.5
+    if nblocks > 1:
+        # children identical to their parents are a wasted evaluation,
+        # so one random block of such pairs is flipped
+        same = np.all(swap == swap[:, :1], axis=1)
+        flip = rng.integers(0, nblocks, size=n)
+        swap[same, flip[same]] = ~swap[same, flip[same]]
+    swap = swap[:, blocks]
+    return np.where(swap, values2, values1), np.where(swap, values1, values2)
+
+
+def polynomialMutation(values, randMin, randMax, eta, mutProb, rng):
+    """
+    Bounded polynomial mutation (Deb) of an array of gene values. Every
+    gene mutates with probability 'mutProb'; larger 'eta' gives smaller
+    perturbations. Returns mutated copy of the values.
+    """
+    mutDraw, draw = rng.random((2,) + np.shape(values))
+    span = np.asarray(randMax, dtype=float) - randMin
+    delta1 = (values - randMin) / span
+    delta2 = (randMax - values) / span
+    power = 1.0 / (eta + 1.0)
+    down = draw < 0.5
+    val = np.where(down,
+                   2.0 * draw + (1.0 - 2.0 * draw) * (1.0 - delta1) ** (eta + 1.0),
+                   2.0 * (1.0 - draw) + 2.0 * (draw - 0.5) * (1.0 - delta2) ** (eta + 1.0))
+    deltaq = np.where(down, val ** power - 1.0, 1.0 - val ** power)
+    mutated = np.clip(values + deltaq * span, randMin, randMax)
+    return np.where(mutDraw < mutProb, mutated, values)
@@ -3,6 +3,9 @@ pygene/population.py - Represents a population of organisms
 """
 
 import random
+import time
+from heapq import nsmallest
+from operator import attrgetter
 from random import randrange, choice
 from math import sqrt
 
@@ -10,6 +13,47 @@ from .organism import Organism, BaseOrganism
 
 from .xmlio import PGXmlMixin
 
+
+def asCompleted(organisms, pollInterval=0.005):
+    """
+    Collects fitness of the organisms in the order the computations
+    finish, so a slow organism doesn't block the results of the others.
+
+    prepare_fitness is called on all the organisms without
+    cached fitness before anything is collected.
+
+    Yields pairs (index of organism, fitness).
+    """
+    pending = []
+    for idx, org in enumerate(organisms):
+        if org.fitness_cache is None:
+            org.prepare_fitness()
+            pending.append(idx)
+        else:
+            yield idx, org.fitness_cache
+    while pending:
+        waiting = []
+        for idx in pending:
+            if organisms[idx].fitnessReady():
+                yield idx, organisms[idx].get_fitness()
+            else:
+                waiting.append(idx)
+        pending = waiting
+        if pending:
+            time.sleep(pollInterval)
+
+
+def collectFitness(organisms):
+    """
+    Makes sure that all organisms have their fitness cached
+    """
+    for idx, fitness in asCompleted(organisms):
+        pass
+
+
+# sorting key of the organisms: the cached fitness value
+fitnessKey = attrgetter("fitness_cache")
+
 class Population(PGXmlMixin):
     """
     Represents a population of organisms
@@ -238,10 +282,8 @@ class Population(PGXmlMixin):
         if self.incest:
             children.extend(self[:self.incest])
 
-        for child in children:
-            child.prepare_fitness()
-
-        children.sort()
+        collectFitness(children)
+        children.sort(key=fitnessKey)
 
         # and add in some mutants, a proportion of the children
         # with a bias toward the fittest
@@ -258,22 +300,20 @@ class Population(PGXmlMixin):
                     #child = children[nchildren - idx - 1]
                     child = children[-idx]
                     mutant = child.mutate()
-                    mutant.prepare_fitness()
                     mutants.append(mutant)
             else:
                 for i in range(numMutants):
                     mutant = children[i].mutate()
-                    mutant.prepare_fitness()
                     mutants.append(mutant)
 
+            collectFitness(mutants)
             children.extend(mutants)
-            children.sort()
         #print "added %s mutants" % numMutants
 
-        # sort the children by fitness
-
-        # take the best 'nfittest', make them the new population
-        self.organisms[:] = children[:nfittest]
+        # take the best 'nfittest' children (partial selection,
+        # the rest of children doesn't need to be ordered),
+        # make them the new population
+        self.organisms[:] = nsmallest(nfittest, children, key=fitnessKey)
 
         self.sorted = True
 
@@ -324,9 +364,8 @@ class Population(PGXmlMixin):
         costly sorting
         """
         if not self.sorted:
-            for organism in self.organisms:
-                organism.prepare_fitness()
-            self.organisms.sort()
+            collectFitness(self.organisms)
+            self.organisms.sort(key=fitnessKey)
             self.sorted = True
 
     # methods for loading/saving to/from xml
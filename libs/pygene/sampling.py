@@ -0,0 +1,152 @@
+"""
+pygene/sampling.py - Space-filling designs for the initial population
+
+All the functions return points in the unit hypercube, as an array of
+shape (n, d). ArrayPopulation maps them to the randMin..randMax range
+of every gene.
+
+    - uniform - independent uniform random points
+
+    - latinHypercube - Latin hypercube: every one of n equal strata of
+      every dimension contains exactly one point
+
+    - sobol - Sobol' low-discrepancy sequence scrambled by a random
+      digital shift
+
+    - gaussian - normal distribution around a given centre, clipped
+      to the unit hypercube
+"""
+
+import numpy as np
+
+# number of bits of the Sobol' sequence points
+SOBOL_BITS = 30
+
+
+def uniform(n, d, rng):
+    """
+    Independent uniform random points
+    """
+    return rng.random((n, d))
+
+
+def latinHypercube(n, d, rng):
+    """
+    Random Latin hypercube design
+    """
+    strata = rng.permuted(np.tile(np.arange(n), (d, 1)), axis=1).T
+    return (strata + rng.random((n, d))) / n
+
+
+def _isPrimitive(poly, degree):
+    """
+    Checks if a polynomial over GF(2), given as an integer whose bits
+    are the coefficients, is primitive
+    """
+    order = (1 << degree) - 1
+
+    def mulmod(a, b):
+        result = 0
+        while b:
+            if b & 1:
+                result ^= a
+            b >>= 1
+            a <<= 1
+            if a >> degree:
+                a ^= poly
+        return result
+
+    def powmod(exponent):
+        result, base = 1, 2
+        while exponent:
+            if exponent & 1:
+                result = mulmod(result, base)
+            base = mulmod(base, base)
+            exponent >>= 1
+        return result
+
+    if powmod(order) != 1:
+        return False
+    factors = set()
+    rest, factor = order, 2
+    while factor * factor <= rest:
+        while rest % factor == 0:
+            factors.add(factor)
+            rest //= factor
+        factor += 1
+    if rest > 1:
+        factors.add(rest)
+    return all(powmod(order // q) != 1 for q in factors)
+
+
+def _primitivePolynomials(count):
+    """
+    Returns 'count' primitive polynomials over GF(2) in the order of
+    increasing degree, as (degree, polynomial) pairs
+    """
+    polys = []
+    degree = 1
+    while len(polys) < count:
+        for poly in range((1 << degree) + 1, 1 << (degree + 1), 2):
+            if _isPrimitive(poly, degree):
+                polys.append((degree, poly))
+                if len(polys) == count:
+                    break
+        degree += 1
+    return polys
+
+
+def _directionNumbers(d, rng):
+    """
+    Direction numbers of the Sobol' sequence for d dimensions. The first
+    dimension is the van der Corput sequence, the initial direction
+    numbers of the other dimensions are random odd integers m_k < 2^k.
+    """
+    directions = np.zeros((d, SOBOL_BITS), dtype=np.int64)
+    directions[0] = 1 << np.arange(SOBOL_BITS - 1, -1, -1)
+    for dim, (degree, poly) in enumerate(_primitivePolynomials(d - 1), start=1):
+        v = [0] * SOBOL_BITS
+        for k in range(min(degree, SOBOL_BITS)):
+            m = 2 * int(rng.integers(0, 1 << k)) + 1
+            v[k] = m << (SOBOL_BITS - k - 1)
+        for k in range(degree, SOBOL_BITS):
+            value = v[k - degree] ^ (v[k - degree] >> degree)
+            for i in range(1, degree):
+                if (poly >> (degree - i)) & 1:
+                    value ^= v[k - i]
+            v[k] = value
+        directions[dim] = v
+    return directions
+
+
+def sobol(n, d, rng):
+    """
+    Sobol' sequence (randomly chosen direction numbers) scrambled by
+    a random digital shift
+    """
+    directions = _directionNumbers(d, rng)
+    index = np.arange(n, dtype=np.int64)
+    points = np.zeros((n, d), dtype=np.int64)
+    for bit in range(SOBOL_BITS):
+        # Gray code of the index selects the direction numbers
+        gray = ((index ^ (index >> 1)) >> bit) & 1
+        points ^= gray[:, np.newaxis] * directions[:, bit]
+    shift = rng.integers(0, 1 << SOBOL_BITS, size=d)
+    return (points ^ shift) / float(1 << SOBOL_BITS)
+
+
+def gaussian(n, d, rng, center=0.5, sigma=0.1):
+    """
+    Points normally distributed around the centre (in unit hypercube
+    coordinates) with standard deviation sigma, clipped to the hypercube
+    """
+    return np.clip(center + sigma * rng.standard_normal((n, d)), 0.0, 1.0)
+
+
+# Name to function map for ArrayPopulation's initMethod
+methods = {
+    "uniform": uniform,
+    "lhs": latinHypercube,
+    "sobol": sobol,
+    "gaussian": gaussian,
+}
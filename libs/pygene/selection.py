@@ -0,0 +1,124 @@
+"""
+pygene/selection.py - Vectorized parent selection operators
+
+Every operator here works on a population sorted in order of fitness,
+with the fittest first, and is expressed as a probability distribution
+over the ranks of the organisms. The cumulative distribution is computed
+once per generation and all the parents for the generation are drawn
+from it in a single call.
+
+Available operators (see 'operators' dict):
+
+    - sqrt - the classic pygene rule: index int(sqrt(randrange(n*n)))
+      counted from the end of the population
+
+    - rank - linear ranking. The best organism is selected
+      'pressure' times more often than the average one (1 < pressure <= 2)
+
+    - tournament - the best of 'pressure' randomly chosen organisms
+      (tournament with replacement, pressure is rounded to an integer)
+
+    - sus - stochastic universal sampling with fitness-proportional
+      weights. Fitness values are inverted and windowed, so the worst
+      organism still has a small chance to be selected. All parents
+      are picked by a single spin of an evenly spaced wheel.
+"""
+
+import numpy as np
+
+
+def sqrtProbabilities(fitnesses, pressure=None):
+    """
+    Probabilities of the square-root rule of Population.gen
+    """
+    n = len(fitnesses)
+    # idx = k is drawn with probability (2k+1)/n^2 and gives
+    # the organism number (-k) % n
+    k = np.arange(n)
+    probs = np.empty(n)
+    probs[(-k) % n] = (2 * k + 1) / float(n * n)
+    return probs
+
+
+def rankProbabilities(fitnesses, pressure=1.5):
+    """
+    Probabilities of linear ranking selection
+    """
+    n = len(fitnesses)
+    pressure = min(max(pressure, 1.0), 2.0)
+    ranks = np.arange(n)
+    return (pressure - 2.0 * (pressure - 1.0) * ranks / (n - 1)) / n
+
+
+def tournamentProbabilities(fitnesses, pressure=2):
+    """
+    Probabilities of winning a tournament of 'pressure' organisms,
+    drawn with replacement
+    """
+    n = len(fitnesses)
+    size = max(int(round(pressure)), 1)
+    # The winner is the one with the lowest rank, so
+    # P(rank >= i) = ((n - i) / n)^size
+    tail = ((n - np.arange(n + 1)) / float(n)) ** size
+    return tail[:-1] - tail[1:]
+
+
+def proportionalProbabilities(fitnesses, pressure=None):
+    """
+    Fitness-proportional probabilities for a minimised fitness
+    """
+    fitnesses = np.asarray(fitnesses, dtype=float)
+    worst = fitnesses.max()
+    window = worst - fitnesses.min()
+    if window <= 0:
+        return np.full(len(fitnesses), 1.0 / len(fitnesses))
+    weights = worst - fitnesses + window / len(fitnesses)
+    return weights / weights.sum()
+
+
+# name: (probabilities function, use stochastic universal sampling)
+operators = {
+    "sqrt": (sqrtProbabilities, False),
+    "rank": (rankProbabilities, False),
+    "tournament": (tournamentProbabilities, False),
+    "sus": (proportionalProbabilities, True),
+}
+
+
+def selectPairs(fitnesses, npairs, rng, operator="sqrt", pressure=2.0):
+    """
+    Selects 'npairs' pairs of distinct parents from a population
+    with given (sorted, fittest first) fitness values.
+
+    Returns two arrays of indices.
+    """
+    n = len(fitnesses)
+    if n < 2:
+        raise ValueError("At least two organisms are needed to select parents")
+    try:
+        probsFunc, universal = operators[operator]
+    except KeyError:
+        raise ValueError("Unknown selection operator '%s'" % operator)
+    cdf = np.cumsum(probsFunc(fitnesses, pressure))
+    cdf /= cdf[-1]
+
+    if universal:
+        pointers = (rng.random() + np.arange(2 * npairs)) / (2 * npairs)
+        chosen = np.minimum(np.searchsorted(cdf, pointers, side="right"), n - 1)
+        rng.shuffle(chosen)
+        idx1, idx2 = chosen.reshape(2, npairs)
+    else:
+        idx1, idx2 = np.minimum(np.searchsorted(cdf, rng.random((2, npairs)), side="right"), n - 1)
+
+    # the second parent has to be different from the first one
+    same = idx1 == idx2
+    for attempt in range(100):
+        if not same.any():
+            break
+        idx2[same] = np.minimum(np.searchsorted(cdf, rng.random(same.sum()), side="right"), n - 1)
+        same = idx1 == idx2
+    else:
+        # distribution is concentrated on a single organism,
+        # pick the partners uniformly
+        idx2[same] = (idx1[same] + rng.integers(1, n, size=same.sum())) % n
+    return idx1, idx2
@@ -0,0 +1,336 @@
+"""
+pygene/strategies.py - Evolution strategies for continuous genomes
+
+The classes here are drop-in alternatives to ArrayPopulation: they take
+the same species (organisms with FloatGeneMax genes), evaluate fitness
+through the species' prepare_fitness/fitness methods, and offer the
+same interface (gen, best, fitness, [], len). Every generation the
+whole batch of candidates is submitted for evaluation before any result
+is requested, so the species can evaluate them in parallel.
+
+Both strategies work in normalised coordinates, where every gene
+spans [0, 1] between its randMin and randMax, and keep both alleles
+of every gene pair equal.
+
+Available strategies:
+
+    - CMAESPopulation - covariance matrix adaptation evolution
+      strategy with IPOP restarts (the population size is doubled
+      on every restart)
+
+    - DEPopulation - differential evolution (DE/rand/1/bin)
+
+The initial population of size 'init' is drawn randomly, as for the
+GA. CMA-ES starts from the best organism of it, DE takes 'childCull'
+best organisms of it as its population.
+"""
+
+import numpy as np
+
+from .arraypop import ArrayPopulation
+
+
+class CMAESPopulation(ArrayPopulation):
+    """
+    Covariance matrix adaptation evolution strategy with IPOP restarts
+
+    Overridable class variables (in addition to ArrayPopulation ones):
+
+        - sigma0 - initial step size in normalised coordinates
+
+        - cmaPopSize - number of candidates in each generation before
+          any restart. If None, the default 4 + 3 ln(G) is used
+
+        - ipopFactor - multiplier of the number of candidates on restart
+
+        - tolX - restart when the step size in all directions drops
+          below this value
+
+        - tolFun - restart when the best fitness stays within this
+          relative range for the stall period
+
+        - maxCondition - restart when the condition number of the
+          covariance matrix exceeds this value
+
+    The population consists of the last generation of candidates plus
+    the best organism found so far. The own restarts of the strategy are
+    counted by 'ipopRestarts', 'restarts' counts the reseeds only.
+    """
+    realCoded = True
+
+    sigma0 = 0.3
+    cmaPopSize = None
+    ipopFactor = 2
+    tolX = 1e-7
+    tolFun = 1e-9
+    maxCondition = 1e14
+
+    def __init__(self, **kw):
+        ArrayPopulation.__init__(self, **kw)
+        for key in ("sigma0", "cmaPopSize", "ipopFactor", "tolX", "tolFun", "maxCondition"):
+            if key in kw:
+                setattr(self, key, kw[key])
+        self.ngenes = len(self.geneNames)
+        self.span = self.randMax - self.randMin
+        self.lam = None
+        self.mean = None
+        self.ipopRestarts = 0
+
+    def restart(self):
+        """
+        (Re)initialises the state of the strategy. The first start is
+        from the best organism found so far, the restarts are from random
+        points with the increased number of candidates.
+        """
+        ngenes = self.ngenes
+        if self.lam is None:
+            self.lam = self.cmaPopSize or 4 + int(3 * np.log(ngenes))
+            self.mean = (self.phenotypes()[0] - self.randMin) / self.span
+        else:
+            self.lam *= self.ipopFactor
+            self.mean = self.rng.random(ngenes)
+        self.sigma = self.sigma0
+        self.cov = np.eye(ngenes)
+        self.eigBasis = np.eye(ngenes)
+        self.eigScale = np.ones(ngenes)
+        self.pathC = np.zeros(ngenes)
+        self.pathS = np.zeros(ngenes)
+        self.bestHistory = []
+        self.generation = 0
+        self.strategyParams()
+
+    def strategyParams(self):
+        """
+        Computes the recombination weights and learning rates
+        for the current number of candidates
+        """
+        ngenes = self.ngenes
+        mu = self.lam // 2
+        weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        mueff = self.mueff
+        self.cc = (4 + mueff / ngenes) / (ngenes + 4 + 2 * mueff / ngenes)
+        self.cs = (mueff + 2) / (ngenes + mueff + 5)
+        self.c1 = 2 / ((ngenes + 1.3) ** 2 + mueff)
+        self.cmu = min(1 - self.c1, 2 * (mueff - 2 + 1 / mueff) / ((ngenes + 2) ** 2 + mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((mueff - 1) / (ngenes + 1)) - 1) + self.cs
+        self.chiN = np.sqrt(ngenes) * (1 - 1.0 / (4 * ngenes) + 1.0 / (21 * ngenes ** 2))
+        self.stallGens = 10 + int(np.ceil(30.0 * ngenes / self.lam))
+
+    def reseed(self, nelite):
+        """
+        Forces an IPOP restart of the strategy, keeping the 'nelite'
+        fittest organisms. Unlike ArrayPopulation.reseed, no random
+        organisms are added: the restarted strategy samples the new ones.
+        """
+        self.sort()
+        self._take(np.arange(min(nelite, len(self))))
+        self.mutationScale = 1.0
+        self.restarts += 1
+        if self.mean is not None:
+            self.restart()
+
+    def getState(self):
+        """
+        Returns the state of the population (see ArrayPopulation.getState)
+        together with the distribution of the strategy
+        """
+        state = ArrayPopulation.getState(self)
+        state["cmaIpopRestarts"] = np.array(self.ipopRestarts)
+        if self.mean is not None:
+            state.update(cmaLam=np.array(self.lam), cmaMean=self.mean, cmaSigma=np.array(self.sigma),
+                         cmaCov=self.cov, cmaEigBasis=self.eigBasis, cmaEigScale=self.eigScale,
+                         cmaPathC=self.pathC, cmaPathS=self.pathS, cmaBestHistory=np.array(self.bestHistory),
+                         cmaGeneration=np.array(self.generation))
+        return state
+
+    def setState(self, state):
+        """
+        Restores the state returned by getState
+        """
+        ArrayPopulation.setState(self, state)
+        self.ipopRestarts = int(state["cmaIpopRestarts"])
+        if "cmaMean" not in state:
+            self.lam = None
+            self.mean = None
+            return
+        self.lam = int(state["cmaLam"])
+        self.strategyParams()
+        self.mean = np.array(state["cmaMean"])
+        self.sigma = float(state["cmaSigma"])
+        self.cov = np.array(state["cmaCov"])
+        self.eigBasis = np.array(state["cmaEigBasis"])
+        self.eigScale = np.array(state["cmaEigScale"])
+        self.pathC = np.array(state["cmaPathC"])
+        self.pathS = np.array(state["cmaPathS"])
+        self.bestHistory = list(state["cmaBestHistory"])
+        self.generation = int(state["cmaGeneration"])
+
+    def sample(self):
+        """
+        Returns 'lam' candidates in normalised coordinates,
+        clipped to the [0, 1] box
+        """
+        z = self.rng.standard_normal((self.lam, self.ngenes))
+        y = (z * self.eigScale).dot(self.eigBasis.T)
+        return np.clip(self.mean + self.sigma * y, 0.0, 1.0)
+
+    def update(self, candidates, fitnesses):
+        """
+        Updates the mean, the evolution paths, the covariance matrix
+        and the step size from evaluated candidates
+        """
+        ngenes = self.ngenes
+        order = np.argsort(fitnesses, kind="stable")
+        selected = candidates[order[:len(self.weights)]]
+        oldMean = self.mean
+        self.mean = self.weights.dot(selected)
+        step = (self.mean - oldMean) / self.sigma
+
+        invSqrtC = (self.eigBasis / self.eigScale).dot(self.eigBasis.T)
+        self.pathS = (1 - self.cs) * self.pathS + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * invSqrtC.dot(step)
+        self.generation += 1
+        normS = np.linalg.norm(self.pathS)
+        hsig = normS / np.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chiN < 1.4 + 2.0 / (ngenes + 1)
+        self.pathC = (1 - self.cc) * self.pathC + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+
+        steps = (selected - oldMean) / self.sigma
+        rankMu = (steps.T * self.weights).dot(steps)
+        rankOne = np.outer(self.pathC, self.pathC) + (1 - hsig) * self.cc * (2 - self.cc) * self.cov
+        self.cov = (1 - self.c1 - self.cmu) * self.cov + self.c1 * rankOne + self.cmu * rankMu
+        self.sigma *= np.exp((self.cs / self.damps) * (normS / self.chiN - 1))
+
+        self.cov = np.triu(self.cov) + np.triu(self.cov, 1).T
+        eigValues, self.eigBasis = np.linalg.eigh(self.cov)
+        self.eigScale = np.sqrt(np.maximum(eigValues, 1e-30))
+        self.bestHistory.append(fitnesses[order[0]])
+
+    def stalled(self):
+        """
+        Checks the restart conditions of the strategy
+        """
+        if self.sigma * self.eigScale.max() < self.tolX:
+            return True
+        if (self.eigScale.max() / self.eigScale.min()) ** 2 > self.maxCondition:
+            return True
+        if len(self.bestHistory) >= self.stallGens:
+            recent = self.bestHistory[-self.stallGens:]
+            if max(recent) - min(recent) <= self.tolFun * abs(min(recent)):
+                return True
+        return False
+
+    def gen(self, nfittest=None, nchildren=None):
+        """
+        Executes a generation of the strategy: samples and evaluates
+        a batch of candidates and updates the distribution. The
+        population becomes the new candidates plus the best organism
+        found so far.
+        """
+        self.sort()
+        if self.mean is None:
+            self.restart()
+        candidates = self.sample()
+        children = self.homozygous(self.randMin + candidates * self.span)
+        organisms, fitnesses = self.evaluateAlleles(children)
+        self.update(candidates, fitnesses)
+
+        children = np.concatenate((self.alleles[:1], children))
+        fitnesses = np.concatenate((self.fitnesses[:1], fitnesses))
+        organisms = self.organisms[:1] + organisms
+        order = np.argsort(fitnesses, kind="stable")
+        self.alleles = children[order]
+        self.fitnesses = fitnesses[order]
+        self.organisms = [organisms[i] for i in order]
+        self.sorted = True
+        if self.stalled():
+            self.ipopRestarts += 1
+            self.restart()
+
+
+class DEPopulation(ArrayPopulation):
+    """
+    Differential evolution (DE/rand/1/bin)
+
+    Overridable class variables (in addition to ArrayPopulation ones):
+
+        - differentialWeight - the F factor of the difference vector
+
+        - crossoverRate - probability to take a gene from the
+          mutant vector (CR)
+
+    The population size is 'childCull'. Every generation a trial
+    vector is built for each member and replaces it if it is not worse.
+    """
+    realCoded = True
+
+    differentialWeight = 0.8
+    crossoverRate = 0.9
+
+    def __init__(self, **kw):
+        ArrayPopulation.__init__(self, **kw)
+        for key in ("differentialWeight", "crossoverRate"):
+            if key in kw:
+                setattr(self, key, kw[key])
+        self.span = self.randMax - self.randMin
+        self.started = False
+
+    def reseed(self, nelite):
+        """
+        Reseeds the population (see ArrayPopulation.reseed); the best
+        'childCull' organisms of the new one form the DE population
+        """
+        ArrayPopulation.reseed(self, nelite)
+        self.started = False
+
+    def getState(self):
+        """
+        Returns the state of the population (see ArrayPopulation.getState)
+        """
+        state = ArrayPopulation.getState(self)
+        state["deStarted"] = np.array(self.started)
+        return state
+
+    def setState(self, state):
+        """
+        Restores the state returned by getState
+        """
+        ArrayPopulation.setState(self, state)
+        self.started = bool(state["deStarted"])
+
+    def gen(self, nfittest=None, nchildren=None):
+        """
+        Executes a generation of differential evolution
+        """
+        self.sort()
+        if not self.started:
+            # the best members of the random zero generation
+            # form the population
+            self._take(np.arange(min(nfittest or self.childCull, len(self))))
+            self.started = True
+        npop, ngenes = len(self), len(self.geneNames)
+        if npop < 4:
+            raise ValueError("Differential evolution needs at least 4 organisms")
+        current = (self.phenotypes() - self.randMin) / self.span
+
+        # three distinct random members other than the target one
+        keys = self.rng.random((npop, npop))
+        keys[np.arange(npop), np.arange(npop)] = np.inf
+        r1, r2, r3 = np.argsort(keys, axis=1)[:, :3].T
+        mutant = current[r1] + self.differentialWeight * (current[r2] - current[r3])
+        cross = self.rng.random((npop, ngenes)) < self.crossoverRate
+        cross[np.arange(npop), self.rng.integers(0, ngenes, size=npop)] = True
+        trial = np.where(cross, mutant, current)
+        # genes out of bounds are put midway between the target and the bound
+        trial = np.where(trial < 0, current / 2, trial)
+        trial = np.where(trial > 1, (current + 1) / 2, trial)
+
+        trialAlleles = self.homozygous(self.randMin + trial * self.span)
+        organisms, fitnesses = self.evaluateAlleles(trialAlleles)
+
+        better = fitnesses <= self.fitnesses
+        self.alleles = np.where(better[:, np.newaxis, np.newaxis], trialAlleles, self.alleles)
+        self.fitnesses = np.where(better, fitnesses, self.fitnesses)
+        self.organisms = [org if b else old for org, old, b in zip(organisms, self.organisms, better)]
+        self.sorted = False
+        self.sort()
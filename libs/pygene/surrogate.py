@@ -0,0 +1,103 @@
+"""
+pygene/surrogate.py - Surrogate model of the fitness function
+
+A cheap regression model trained on all the (phenotype, fitness) pairs
+evaluated so far. ArrayPopulation uses it to predict the fitness of
+freshly bred children and sends only the most promising of them (plus
+a few random ones for exploration) to the real fitness evaluation.
+
+The model is a radial basis function interpolant with the cubic kernel
+and a linear polynomial tail, built in normalised coordinates (every
+gene spans [0, 1] between its randMin and randMax). Fitness values are
+modelled in the log space when they are all positive, since chi
+squared values span orders of magnitude.
+"""
+
+import numpy as np
+
+
+def rankCorrelation(values1, values2):
+    """
+    Spearman rank correlation of two arrays (nan if it can't be computed)
+    """
+    if len(values1) < 3:
+        return np.nan
+    ranks1 = np.argsort(np.argsort(values1)).astype(float)
+    ranks2 = np.argsort(np.argsort(values2)).astype(float)
+    if ranks1.std() == 0 or ranks2.std() == 0:
+        return np.nan
+    return np.corrcoef(ranks1, ranks2)[0, 1]
+
+
+class RBFSurrogate(object):
+    """
+    Cubic radial basis function model of the fitness
+
+    Class variables (to override):
+        - maxPoints - number of the most recent evaluations the model
+          is built on
+    """
+    maxPoints = 500
+
+    def __init__(self, randMin, randMax):
+        self.randMin = np.asarray(randMin, dtype=float)
+        self.span = np.asarray(randMax, dtype=float) - self.randMin
+        self.points = np.empty((0, len(self.randMin)))
+        self.values = np.empty(0)
+        self.model = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, phenotypes, fitnesses):
+        """
+        Adds evaluated phenotypes (array of shape (n, G)) and their
+        fitness values to the training set
+        """
+        fitnesses = np.asarray(fitnesses, dtype=float)
+        good = np.isfinite(fitnesses)
+        points = (np.asarray(phenotypes)[good] - self.randMin) / self.span
+        self.points = np.concatenate((self.points, points))[-self.maxPoints:]
+        self.values = np.concatenate((self.values, fitnesses[good]))[-self.maxPoints:]
+        self.model = None
+
+    def ready(self):
+        """
+        Returns True if there are enough points to build the model
+        """
+        return len(self) > self.points.shape[1] + 1
+
+    def _basis(self, points):
+        """
+        Matrix of the kernel values between given points and the
+        training points
+        """
+        dist = np.sqrt(((points[:, np.newaxis, :] - self.points[np.newaxis, :, :]) ** 2).sum(axis=2))
+        return dist ** 3
+
+    def fit(self):
+        """
+        Builds the interpolant from the training set
+        """
+        npoints, ndim = self.points.shape
+        self.logScale = bool(np.all(self.values > 0))
+        target = np.log(self.values) if self.logScale else self.values
+        tail = np.hstack((np.ones((npoints, 1)), self.points))
+        system = np.zeros((npoints + ndim + 1, npoints + ndim + 1))
+        system[:npoints, :npoints] = self._basis(self.points)
+        system[:npoints, npoints:] = tail
+        system[npoints:, :npoints] = tail.T
+        rhs = np.concatenate((target, np.zeros(ndim + 1)))
+        self.model = np.linalg.lstsq(system, rhs, rcond=None)[0]
+
+    def predict(self, phenotypes):
+        """
+        Predicts fitness values for an array of phenotypes of shape (n, G)
+        """
+        if self.model is None:
+            self.fit()
+        points = (np.asarray(phenotypes) - self.randMin) / self.span
+        npoints = len(self.points)
+        tail = np.hstack((np.ones((len(points), 1)), points))
+        prediction = self._basis(points).dot(self.model[:npoints]) + tail.dot(self.model[npoints:])
+        return np.exp(prediction) if self.logScale else prediction
@@ -39,7 +39,7 @@ class PGXmlMixin(object):
         dumps out to xml, returning a string of the raw
         generated xml
         """
-        s = StringIO.StringIO()
+        s = StringIO()
         self.xmlDump(s)
         return s.getvalue()
     
@@ -1,10 +1,23 @@
 #! /usr/bin/env python
 
 import uuid
+import math
 from os import getcwd
 from os.path import exists
 from libs.pygene.gene import FloatGeneMax
 
+# Genes are evolved in the [0, 1] range, encodings map it to the parameter range:
+# linear - uniformly; log - uniformly in the logarithm (parameter limits have
+# to be positive); logit - uniformly in logit of the parameter's relative position
+# in its range (denser near the limits)
+ENCODINGS = ("linear", "log", "logit")
+# Scale-type parameters (intensities and radii) of imfit functions, which
+# get the log encoding automatically
+LOG_PARAMS = ("I_e", "I_0", "I_b", "L_0", "r_e", "r_b", "h", "h1", "h2", "h_z", "z_0",
+              "sigma", "fwhm", "a_bar", "r_break")
+# The logit encoding covers relative positions from LOGIT_EPS to 1-LOGIT_EPS
+LOGIT_EPS = 1e-3
+
 
 def parse_imfit_line(line):
     """ Function parses line of imfit data file and
@@ -16,30 +29,146 @@ def parse_imfit_line(line):
     # Lets now find range of values. Its have to contain the coma and must
     # be the second enrty (otherwise imfin wont work).
     # Some parameters can be fixed, so we have to check this possibility at first
+    tie = None
+    encodingSpec = None
     if (len(params) == 2) or ("fixed" in params[2]):
         # No bounds specified at all or fixed value
         lowerLim = upperLim = None
+    elif params[2] == "tie":
+        # Parameter is tied to another one: "tie Func.N:par", "tie Func.N:par + offset"
+        # or "tie Func.N:par * ratio"
+        lowerLim = upperLim = None
+        if len(params) == 4:
+            tie = (params[3], "+", 0.0)
+        elif (len(params) == 6) and (params[4] in ("+", "-", "*", "/")):
+            tie = (params[3], params[4], float(params[5]))
+        else:
+            raise ValueError("Wrong tie specification in line '%s'" % line)
     else:
         rangeParams = params[2].split(",")
         lowerLim = float(rangeParams[0])
         upperLim = float(rangeParams[1])
+        # The range can be followed by the encoding of the gene
+        if len(params) > 3:
+            if params[3] not in ENCODINGS:
+                raise ValueError("Unknown encoding '%s' in line '%s'" % (params[3], line))
+            encodingSpec = params[3]
 
-    return ImfitParameter(name, value, lowerLim, upperLim)
+    param = ImfitParameter(name, value, lowerLim, upperLim, tie)
+    param.encodingSpec = encodingSpec
+    return param
+
+
+def read_seed_file(fileName, withFitness=False):
+    """ Reads parameter values of a previous run to seed the initial
+    population. The file can be a generations file written by
+    ImfitModel.model_to_text (its distinct rows are used, the best
+    fitness first: the rows of the generations without improvement
+    repeat the same organism) or an imfit model file, e.g. result.dat. Returns a list of
+    dictionaries of parameter values with the same keys as the genome
+    created by ImfitModel.create_genome (use ImfitModel.encode_genome
+    to convert them to genes). If withFitness is True, the list is of
+    (fitness, values) pairs, the fitness is None for a model file"""
+    firstLine = open(fileName).readline()
+    if not firstLine.startswith("# genNumber"):
+        values = ImfitModel(fileName, quiet=True).model_to_values()
+        if withFitness:
+            return [(None, values)]
+        return [values]
+    # Column names of parameters are "<func.uname>.<param>", gene names
+    # are "<func.uname>:<param>". Other columns (GA statistics) are skipped
+    columns = firstLine.split()[1:]
+    params = [(i, "%s:%s" % tuple(name.rsplit(".", 1))) for i, name in enumerate(columns) if "." in name]
+    rows = []
+    for line in open(fileName):
+        if line.startswith("#") or (len(line.strip()) == 0):
+            continue
+        values = [float(v) for v in line.split()]
+        rows.append((values[1], dict((name, values[i]) for i, name in params)))
+    rows.sort(key=lambda row: row[0])
+    distinct = set()
+    distinctRows = []
+    for ftns, genome in rows:
+        key = tuple(sorted(genome.items()))
+        if key not in distinct:
+            distinct.add(key)
+            distinctRows.append((ftns, genome))
+    rows = distinctRows
+    if withFitness:
+        return rows
+    return [genome for ftns, genome in rows]
 
 
 class ImfitParameter(object):
     """ Just a container of parameter instance:
-    parameter name, value and its range"""
-    def __init__(self, name, value, lowerLim, upperLim):
+    parameter name, value and its range. Tied parameters are
+    not free: their values are computed from the parameters they
+    are tied to, so they are treated as fixed ones"""
+    def __init__(self, name, value, lowerLim, upperLim, tie=None):
         self.name = name
         self.value = value
         self.lowerLim = lowerLim
         self.upperLim = upperLim
+        # (source parameter "Func.N:par", operation, constant)
+        self.tie = tie
+        # encoding given in the model file (or None) and the one in use
+        self.encodingSpec = None
+        self.encoding = "linear"
         if lowerLim is None:
             self.fixed = True
         else:
             self.fixed = False
 
+    def set_encoding(self, mode):
+        """ Chooses the encoding of the gene: the one given in the
+        model file, else 'linear' or, for mode 'auto', 'log' for the
+        scale-type parameters with positive limits """
+        if self.encodingSpec is not None:
+            self.encoding = self.encodingSpec
+        elif (mode == "auto") and (self.name in LOG_PARAMS):
+            self.encoding = "log"
+        else:
+            self.encoding = "linear"
+        if (self.encoding == "log") and (self.fixed or self.lowerLim <= 0):
+            self.encoding = "linear"
+
+    def encode(self, value):
+        """ Converts the parameter value to the gene value in [0, 1] """
+        value = min(max(value, self.lowerLim), self.upperLim)
+        if self.upperLim == self.lowerLim:
+            return 0.0
+        if self.encoding == "log":
+            return math.log(value / self.lowerLim) / math.log(self.upperLim / self.lowerLim)
+        position = (value - self.lowerLim) / (self.upperLim - self.lowerLim)
+        if self.encoding == "logit":
+            position = min(max(position, LOGIT_EPS), 1 - LOGIT_EPS)
+            zMax = math.log((1 - LOGIT_EPS) / LOGIT_EPS)
+            return (math.log(position / (1 - position)) + zMax) / (2 * zMax)
+        return position
+
+    def decode(self, geneValue):
+        """ Converts the gene value in [0, 1] to the parameter value """
+        if self.encoding == "log":
+            value = self.lowerLim * (self.upperLim / self.lowerLim) ** geneValue
+        else:
+            if self.encoding == "logit":
+                zMax = math.log((1 - LOGIT_EPS) / LOGIT_EPS)
+                geneValue = 1 / (1 + math.exp(-(2 * geneValue - 1) * zMax))
+            value = self.lowerLim + geneValue * (self.upperLim - self.lowerLim)
+        # keep rounding errors from moving the limits (see change_value)
+        return min(max(value, self.lowerLim), self.upperLim)
+
+    def tied_value(self, sourceValue):
+        """ Value of a tied parameter given the value of its source """
+        source, operation, constant = self.tie
+        if operation == "+":
+            return sourceValue + constant
+        if operation == "-":
+            return sourceValue - constant
+        if operation == "*":
+            return sourceValue * constant
+        return sourceValue / constant
+
     def tostring(self, fixAll):
         if fixAll or self.fixed:
             return "%s %r fixed\n" % (self.name, self.value)
@@ -90,9 +219,12 @@ class ImfitFunction(object):
 
 
 class ImfitModel(object):
-    """Imfit functions and their parameters"""
-    def __init__(self, modelFileName):
-        print("Reading '%s':" % (modelFileName))
+    """Imfit functions and their parameters. Genes of the free
+    parameters are encoded in the [0, 1] range (see ENCODINGS),
+    'encoding' is 'linear' or 'auto' (by parameter names)"""
+    def __init__(self, modelFileName, quiet=False, encoding="linear"):
+        if not quiet:
+            print("Reading '%s':" % (modelFileName))
         # Read imfit input file
         self.listOfFunctions = []
         self.numberOfParams = 0
@@ -135,22 +267,102 @@ class ImfitModel(object):
                 self.numberOfParams += 1
         # append the last function
         self.listOfFunctions.append(currentFunction)
+        self.check_ties()
+        self.apply_ties()
+        self.set_encoding(encoding)
         # Print some statistics
-        print("  %i functions found (%i parameters)\n" % (len(self.listOfFunctions), self.numberOfParams))
+        if not quiet:
+            print("  %i functions found (%i parameters, %i free)\n" % (len(self.listOfFunctions),
+                                                                    self.numberOfParams,
+                                                                    len(self.free_params())))
 
     def get_func_by_uname(self, uname):
         for func in self.listOfFunctions:
             if uname == func.uname:
                 return func
 
-    def create_input_file(self, fileName=None, fixAll=False):
+    def get_par_by_key(self, key):
+        """ Returns parameter by its genome key "Func.N:par" """
+        funcName, parName = key.split(":")
+        func = self.get_func_by_uname(funcName)
+        if func is None:
+            return None
+        return func.get_par_by_name(parName)
+
+    def free_params(self):
+        """ Returns the list of (key, parameter) pairs of free parameters.
+        Functions sharing a centre (X0 and Y0 given once for several
+        functions, as in imfit's function blocks) hold the same
+        parameter objects, which are listed once under the name of the
+        first function of the block"""
+        params = []
+        seen = set()
+        for func in self.listOfFunctions:
+            for par in func.params:
+                if (not par.fixed) and (id(par) not in seen):
+                    seen.add(id(par))
+                    params.append((func.uname+":"+par.name, par))
+        return params
+
+    def check_ties(self):
+        """ Checks that all tied parameters refer to existing parameters
+        and that there are no cycles of ties """
+        for func in self.listOfFunctions:
+            for par in func.params:
+                visited = [par]
+                while par.tie is not None:
+                    source = self.get_par_by_key(par.tie[0])
+                    if source is None:
+                        raise ValueError("%s: %s is tied to unknown parameter %s" % (func.uname, par.name,
+                                                                                   par.tie[0]))
+                    if source in visited:
+                        raise ValueError("%s: %s has a cycle of ties" % (func.uname, visited[0].name))
+                    visited.append(source)
+                    par = source
+
+    def source_value(self, par):
+        """ Value of a parameter with all the ties resolved """
+        if par.tie is None:
+            return par.value
+        return par.tied_value(self.source_value(self.get_par_by_key(par.tie[0])))
+
+    def apply_ties(self):
+        """ Sets the values of the tied parameters from their sources """
+        for func in self.listOfFunctions:
+            for par in func.params:
+                if par.tie is not None:
+                    par.value = self.source_value(par)
+
+    def set_encoding(self, mode):
+        """ Chooses encodings of all free parameters ('linear' or 'auto')"""
+        for key, par in self.free_params():
+            par.set_encoding(mode)
+
+    def tie_centres(self):
+        """ Makes all the functions share the centre of the first one,
+        so that they form a single imfit function block """
+        x0 = self.listOfFunctions[0].params[0]
+        y0 = self.listOfFunctions[0].params[1]
+        for func in self.listOfFunctions[1:]:
+            func.params[0] = x0
+            func.params[1] = y0
+
+    def create_input_file(self, fileName=None, fixAll=False, directory=None):
         if fileName is None:
-            fileName = "%s/results/temp_%s.dat" % (getcwd(), uuid.uuid4())
+            if directory is None:
+                directory = "%s/results" % getcwd()
+            fileName = "%s/temp_%s.dat" % (directory, uuid.uuid4())
         fout = open(fileName, "w")
         fout.truncate(0)
+        prevFunc = None
         for func in self.listOfFunctions:
-            fout.write(func.get_par_by_name("X0").tostring(fixAll))
-            fout.write(func.get_par_by_name("Y0").tostring(fixAll))
+            # Functions sharing the centre object with the previous one
+            # are written to the same function block
+            if (prevFunc is None) or (func.params[0] is not prevFunc.params[0]) or \
+                    (func.params[1] is not prevFunc.params[1]):
+                fout.write(func.get_par_by_name("X0").tostring(fixAll))
+                fout.write(func.get_par_by_name("Y0").tostring(fixAll))
+            prevFunc = func
             fout.write("FUNCTION " + func.name+"\n")
             for par in func.params[2:]:
                 fout.write(par.tostring(fixAll))
@@ -166,26 +378,49 @@ class ImfitModel(object):
         names of these classes)"""
         genomeClasses = []
         genome = {}
-        for func in self.listOfFunctions:
-            for par in func.params:
-                if not par.fixed:
-                    class ParamGene(FloatGeneMax):
-                        randMin = par.lowerLim
-                        randMax = par.upperLim
-                        mutProb = 0.5
-                        mutAmt = 0.01
-                    genomeClasses.append(ParamGene)
-                    genome[func.uname+":"+par.name] = ParamGene
+        for key, par in self.free_params():
+            class ParamGene(FloatGeneMax):
+                randMin = 0.0
+                randMax = 1.0
+                mutProb = 0.5
+                mutAmt = 0.01
+            genomeClasses.append(ParamGene)
+            genome[key] = ParamGene
         return genome
 
     def genome_to_model(self, genome):
-        """Set model parameter values according to given genome"""
+        """Set model parameter values according to given genome
+        and update the tied parameters"""
         for gene in genome:
-            funcName, parName = gene.split(":")
-            func = self.get_func_by_uname(funcName)
-            for par in func.params:
-                if par.name == parName:
-                    par.change_value(genome[gene])
+            par = self.get_par_by_key(gene)
+            if par is not None:
+                par.change_value(par.decode(genome[gene]))
+        self.apply_ties()
+
+    def model_to_genome(self):
+        """Returns current values of free model parameters as a dictionary
+        with the same keys as the genome created by create_genome"""
+        genome = {}
+        for key, par in self.free_params():
+            genome[key] = par.encode(par.value)
+        return genome
+
+    def model_to_values(self):
+        """Returns current values of free model parameters (not encoded)"""
+        values = {}
+        for key, par in self.free_params():
+            values[key] = par.value
+        return values
+
+    def encode_genome(self, values):
+        """Converts parameter values (e.g. the ones returned by model_to_values
+        of another model) to the genome of this model. Parameters which are
+        not free in this model are skipped"""
+        genome = {}
+        for key, par in self.free_params():
+            if key in values:
+                genome[key] = par.encode(values[key])
+        return genome
 
     def check_boundaries(self, resModel):
         """ Method takes other model object and checks if its parameter
@@ -202,8 +437,12 @@ class ImfitModel(object):
                     badParams.append("%s(%i): %s" % (selfFunc.name, selfFunc.ident, selfParam.name))
         return badParams
 
-    def model_to_text(self, genNumber, ftns, textFile):
-        """ Method saves current values of model parameters to a text file """
+    def model_to_text(self, genNumber, ftns, textFile, extra=None):
+        """ Method saves current values of model parameters to a text file.
+        'extra' is a list of (name, value) pairs of additional columns
+        (e.g. GA statistics), they have to be the same in every call """
+        if extra is None:
+            extra = []
         if not exists(textFile):
             fout = open(textFile, "w", buffering=1)
             # Create a header as a first line of a file
@@ -211,6 +450,8 @@ class ImfitModel(object):
             for func in self.listOfFunctions:
                 for param in func.params:
                     fout.write("  %s.%s" % (func.uname, param.name))
+            for name, value in extra:
+                fout.write("  %s" % name)
             fout.write("\n")
         else:
             fout = open(textFile, "a", buffering=1)
@@ -218,6 +459,8 @@ class ImfitModel(object):
         for func in self.listOfFunctions:
             for param in func.params:
                 fout.write("  %9.3f" % param.value)
+        for name, value in extra:
+            fout.write("  %9.4g" % value)
         fout.write("\n")
 
 
@@ -225,7 +468,23 @@ class GeneralParams(object):
     """ Input parameters unrelated to imfit (input image, size of the
     population etc.) """
     def __init__(self, fileName):
-        self.params = {}
+        # Default values of optional parameters
+        self.params = {"seed": "none", "selection": "sqrt", "selectionPressure": 2.0,
+                       "crossover": "mendel", "mutation": "float", "optimizer": "ga",
+                       "memeticPeriod": 0, "memeticNum": 3, "memeticFTol": 0.01,
+                       "surrogate": "no", "surrogateFraction": 0.3, "surrogateExplore": 0.1,
+                       "initMethod": "uniform", "initSigma": 0.1, "initSeedFile": "none",
+                       "initSeedFraction": 0.25,
+                       "tieCentres": "no", "geneEncoding": "linear", "mutationControl": "fixed",
+                       "maxRestarts": 0, "restartElite": 5, "restartGrowth": 2.0, "minDiversity": 0.0,
+                       "maxEvaluations": 0, "niching": "none", "nicheRadius": 0.1,
+                       "lmMinDistance": 0.02, "lmRace": "no", "lmRaceMargin": 0.05, "lmRaceMinIter": 5,
+                       "lmRacePeriod": 2.0, "lmEarlyStart": 0.0, "lmStaleMargin": 0.01,
+                       "bootstrapIter": 0, "bootstrapChunks": 0, "executor": "pool",
+                       "schedSubmit": "sbatch --parsable --array=0-{last} --output={spool}/slurm_%a.out {script}",
+                       "schedStatus": "squeue -h -j {jobid}", "schedCancel": "scancel {jobid}",
+                       "schedTaskVar": "SLURM_ARRAY_TASK_ID", "schedGroupSize": 20, "schedSpool": "./spool",
+                       "schedLostChecks": 3, "checkpoint": "yes"}
         for line in open(fileName):
             sLine = line.strip()
             if sLine.startswith("#"):
@@ -263,7 +522,7 @@ class GeneralParams(object):
                 continue
             if sLine.startswith("readNoise"):
                 if sLine.split()[1] == "none":
-                    self.params["readNoise"] == "none"
+                    self.params["readNoise"] = "none"
                 else:
                     self.params["readNoise"] = float(sLine.split()[1])
                 continue
@@ -303,9 +562,144 @@ class GeneralParams(object):
             if sLine.startswith("saveGens"):
                 self.params["saveGens"] = sLine.split()[1]
                 continue
+            if sLine.startswith("selectionPressure"):
+                self.params["selectionPressure"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("selection"):
+                self.params["selection"] = sLine.split()[1]
+                continue
+            if sLine.startswith("memeticPeriod"):
+                self.params["memeticPeriod"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("memeticNum"):
+                self.params["memeticNum"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("memeticFTol"):
+                self.params["memeticFTol"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("surrogateFraction"):
+                self.params["surrogateFraction"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("surrogateExplore"):
+                self.params["surrogateExplore"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("surrogate"):
+                self.params["surrogate"] = sLine.split()[1]
+                continue
+            if sLine.startswith("bootstrapIter"):
+                self.params["bootstrapIter"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("bootstrapChunks"):
+                self.params["bootstrapChunks"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("executor"):
+                self.params["executor"] = sLine.split()[1]
+                continue
+            if sLine.startswith("schedSubmit"):
+                self.params["schedSubmit"] = sLine.split('"')[1]
+                continue
+            if sLine.startswith("schedStatus"):
+                self.params["schedStatus"] = sLine.split('"')[1]
+                continue
+            if sLine.startswith("schedCancel"):
+                self.params["schedCancel"] = sLine.split('"')[1]
+                continue
+            if sLine.startswith("schedTaskVar"):
+                self.params["schedTaskVar"] = sLine.split()[1]
+                continue
+            if sLine.startswith("schedGroupSize"):
+                self.params["schedGroupSize"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("schedLostChecks"):
+                self.params["schedLostChecks"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("schedSpool"):
+                self.params["schedSpool"] = sLine.split()[1]
+                continue
+            if sLine.startswith("checkpoint"):
+                self.params["checkpoint"] = sLine.split()[1]
+                continue
+            if sLine.startswith("lmEarlyStart"):
+                self.params["lmEarlyStart"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("lmStaleMargin"):
+                self.params["lmStaleMargin"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("lmRaceMargin"):
+                self.params["lmRaceMargin"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("lmRaceMinIter"):
+                self.params["lmRaceMinIter"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("lmRacePeriod"):
+                self.params["lmRacePeriod"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("lmRace"):
+                self.params["lmRace"] = sLine.split()[1]
+                continue
+            if sLine.startswith("lmMinDistance"):
+                self.params["lmMinDistance"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("niching"):
+                self.params["niching"] = sLine.split()[1]
+                continue
+            if sLine.startswith("nicheRadius"):
+                self.params["nicheRadius"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("maxRestarts"):
+                self.params["maxRestarts"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("restartElite"):
+                self.params["restartElite"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("restartGrowth"):
+                self.params["restartGrowth"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("minDiversity"):
+                self.params["minDiversity"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("maxEvaluations"):
+                self.params["maxEvaluations"] = int(sLine.split()[1])
+                continue
+            if sLine.startswith("mutationControl"):
+                self.params["mutationControl"] = sLine.split()[1]
+                continue
+            if sLine.startswith("geneEncoding"):
+                self.params["geneEncoding"] = sLine.split()[1]
+                continue
+            if sLine.startswith("tieCentres"):
+                self.params["tieCentres"] = sLine.split()[1]
+                continue
+            if sLine.startswith("initMethod"):
+                self.params["initMethod"] = sLine.split()[1]
+                continue
+            if sLine.startswith("initSigma"):
+                self.params["initSigma"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("initSeedFraction"):
+                self.params["initSeedFraction"] = float(sLine.split()[1])
+                continue
+            if sLine.startswith("initSeedFile"):
+                self.params["initSeedFile"] = sLine.split()[1]
+                continue
+            if sLine.startswith("optimizer"):
+                self.params["optimizer"] = sLine.split()[1]
+                continue
+            if sLine.startswith("crossover"):
+                self.params["crossover"] = sLine.split()[1]
+                continue
+            if sLine.startswith("mutation"):
+                self.params["mutation"] = sLine.split()[1]
+                continue
+            if sLine.startswith("seed"):
+                if sLine.split()[1] == "none":
+                    self.params["seed"] = "none"
+                else:
+                    self.params["seed"] = int(sLine.split()[1])
+                continue
             if sLine.startswith("genTextFile"):
                 if sLine.split()[1] == "none":
-                    self.params["genTextFile"] is None
+                    self.params["genTextFile"] = None
                 else:
                     self.params["genTextFile"] = sLine.split()[1]
 
@@ -318,3 +712,17 @@ class GeneralParams(object):
     def show(self):
         for key, value in self.params.items():
             print("%r: %r" % (key, value))
+
+
+def parse_param_value(default, text):
+    """ Converts the text value of a parameter given on the command
+    line or in a batch manifest to the type of its default value """
+    if isinstance(default, bool) or not isinstance(default, (int, float)):
+        if (default == "none") and (text != "none"):
+            # parameters like gain are either 'none' or numbers
+            try:
+                return float(text)
+            except ValueError:
+                return text
+        return text
+    return type(default)(text)
@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+
+""" Executor running tasks as array jobs of a batch scheduler
+
+Tasks submitted within a short time are grouped into one array job:
+every element of the array runs groupSize tasks one after another.
+Tasks and their results are passed through a spool directory which has
+to be shared by the submitting host and the nodes. The scheduler is
+driven by command templates, for SLURM:
+
+    submit:  sbatch --parsable --array=0-{last} --output={spool}/slurm_%a.out {script}
+    status:  squeue -h -j {jobid}
+    cancel:  scancel {jobid}
+
+The id of the job is the first integer in the output of the submit
+command; the job is finished when the status command prints nothing (or
+fails: squeue does so for old jobs) in lostChecks checks in a row, so that
+a busy scheduler does not make the tasks lost.
+The element index is taken from the taskVar environment variable
+(SLURM_ARRAY_TASK_ID). The executor has the interface of
+concurrent.futures executors and the close/join/terminate methods of
+multiprocessing pools.
+"""
+
+import os
+import pickle
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+import shutil
+import importlib
+from concurrent.futures import Future
+from os import path
+
+
+def task_module(func):
+    """ Module name to import the function from on the nodes (functions
+    of the main script are imported from the script file) """
+    if func.__module__ == "__main__":
+        return path.splitext(path.basename(sys.modules["__main__"].__file__))[0]
+    return func.__module__
+
+
+class ArrayJob(object):
+    """ Tasks of one array job """
+    def __init__(self, batchDir, futures):
+        self.batchDir = batchDir
+        self.futures = futures
+        self.jobId = None
+        self.done = set()
+        self.failed = False
+        self.lastStatus = time.time()
+        # status checks in a row which did not find the job
+        self.missingChecks = 0
+
+
+class SchedulerExecutor(object):
+    """ Runs tasks (picklable module-level functions and their
+    arguments) as array jobs. Tasks are grouped when no new task comes
+    for flushDelay seconds; results are looked for in the spool every
+    pollPeriod seconds and the status of the jobs is checked every
+    statusPeriod seconds: tasks without results of a job which is not
+    found in lostChecks checks in a row fail. """
+    def __init__(self, submitCmd, statusCmd, cancelCmd, taskVar, spoolDir, groupSize=20,
+                 flushDelay=0.5, pollPeriod=1.0, statusPeriod=10.0, lostChecks=3):
+        self.submitCmd = submitCmd
+        self.statusCmd = statusCmd
+        self.cancelCmd = cancelCmd
+        self.taskVar = taskVar
+        self.spoolDir = path.abspath(spoolDir)
+        self.groupSize = groupSize
+        self.flushDelay = flushDelay
+        self.pollPeriod = pollPeriod
+        self.statusPeriod = statusPeriod
+        self.lostChecks = lostChecks
+        if not path.exists(self.spoolDir):
+            os.makedirs(self.spoolDir)
+        self.lock = threading.Condition()
+        # tasks waiting to be grouped: (future, task)
+        self.pending = []
+        self.lastSubmit = 0.0
+        self.jobs = []
+        self.closed = False
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("cannot submit to a closed executor")
+            self.pending.append((future, (task_module(func), func.__name__, args, kwargs)))
+            self.lastSubmit = time.time()
+            self.lock.notify_all()
+        return future
+
+    def flush(self):
+        """ Submits the pending tasks as an array job """
+        with self.lock:
+            tasks, self.pending = self.pending, []
+        if not tasks:
+            return
+        batchDir = path.join(self.spoolDir, "batch_%s" % uuid.uuid4().hex[:12])
+        os.makedirs(batchDir)
+        fout = open(path.join(batchDir, "tasks.pkl"), "wb")
+        pickle.dump([task for future, task in tasks], fout)
+        fout.close()
+        numElements = (len(tasks) + self.groupSize - 1) // self.groupSize
+        script = path.join(batchDir, "run.sh")
+        fout = open(script, "w")
+        fout.write("#!/bin/sh\n")
+        fout.write("cd %s\n" % shlex.quote(os.getcwd()))
+        fout.write("exec %s %s %s \"$%s\" %i\n" % (shlex.quote(sys.executable), shlex.quote(path.abspath(__file__)),
+                                                   shlex.quote(batchDir), self.taskVar, self.groupSize))
+        fout.close()
+        os.chmod(script, 0o755)
+        job = ArrayJob(batchDir, [future for future, task in tasks])
+        command = self.submitCmd.format(last=numElements - 1, count=numElements, script=script,
+                                        spool=batchDir, name=path.basename(batchDir))
+        proc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              universal_newlines=True)
+        match = re.search(r"\d+", proc.stdout)
+        if (proc.returncode != 0) or (match is None):
+            error = RuntimeError("Submit command failed: %s\n%s" % (command, proc.stdout.strip()))
+            for future in job.futures:
+                future.set_exception(error)
+            return
+        job.jobId = match.group(0)
+        with self.lock:
+            self.jobs.append(job)
+
+    def job_running(self, job):
+        """ True if the job is running, False if the status command does
+        not show it, None if the command failed """
+        command = self.statusCmd.format(jobid=job.jobId)
+        proc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True)
+        if proc.returncode != 0:
+            return None
+        return len(proc.stdout.strip()) > 0
+
+    def read_results(self, job):
+        """ Resolves the futures of the tasks with new results """
+        for i, future in enumerate(job.futures):
+            if i in job.done:
+                continue
+            resultFile = path.join(job.batchDir, "result_%i.pkl" % i)
+            if not path.exists(resultFile):
+                continue
+            fin = open(resultFile, "rb")
+            status, value = pickle.load(fin)
+            fin.close()
+            job.done.add(i)
+            if status != "ok":
+                job.failed = True
+            if future.cancelled():
+                continue
+            if status == "ok":
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError("Task %i of job %s failed:\n%s" % (i, job.jobId, value)))
+
+    def collect_job(self, job):
+        """ Reads the new results of the job. Returns True when all the
+        tasks of the job are done """
+        self.read_results(job)
+        if len(job.done) == len(job.futures):
+            if not job.failed:
+                # the spool of failed jobs is kept to look at the errors
+                shutil.rmtree(job.batchDir, ignore_errors=True)
+            return True
+        if time.time() - job.lastStatus > self.statusPeriod:
+            job.lastStatus = time.time()
+            if self.job_running(job):
+                job.missingChecks = 0
+                return False
+            # the status command can fail or miss the job once on a busy
+            # scheduler: the job is finished only if it is not found again
+            job.missingChecks += 1
+            if job.missingChecks >= self.lostChecks:
+                # results could be written after the previous reading
+                self.read_results(job)
+                for i, future in enumerate(job.futures):
+                    if (i not in job.done) and not future.done():
+                        future.set_exception(RuntimeError("Task %i of job %s was lost" % (i, job.jobId)))
+                return True
+        return False
+
+    def collect(self):
+        """ Groups and submits the tasks, collects the results """
+        while True:
+            with self.lock:
+                if self.pending and ((time.time() - self.lastSubmit > self.flushDelay) or
+                                     (len(self.pending) >= 50 * self.groupSize) or self.closed):
+                    flush = True
+                else:
+                    flush = False
+                jobs = list(self.jobs)
+                if self.closed and not (self.pending or jobs):
+                    return
+            if flush:
+                self.flush()
+            for job in jobs:
+                if self.collect_job(job):
+                    with self.lock:
+                        self.jobs.remove(job)
+            time.sleep(min(self.pollPeriod, self.flushDelay))
+
+    def close(self):
+        """ No more tasks will be submitted """
+        with self.lock:
+            self.closed = True
+
+    def join(self):
+        """ Waits for all the tasks (after close) """
+        self.collector.join()
+
+    def terminate(self):
+        """ Cancels all the jobs """
+        with self.lock:
+            self.closed = True
+            jobs, self.jobs = self.jobs, []
+            pending, self.pending = self.pending, []
+        for future, task in pending:
+            future.cancel()
+        for job in jobs:
+            subprocess.run(self.cancelCmd.format(jobid=job.jobId), shell=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for future in job.futures:
+                future.cancel()
+
+    def shutdown(self, wait=True):
+        self.close()
+        if wait:
+            self.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.shutdown()
+        return False
+
+
+def run_tasks(batchDir, element, groupSize):
+    """ Runs the tasks of one element of an array job (on a node) """
+    # the tasks are imported from the working directory of the
+    # submitting process (cd in the job script) or from the package
+    sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+    sys.path.insert(0, os.getcwd())
+    fin = open(path.join(batchDir, "tasks.pkl"), "rb")
+    tasks = pickle.load(fin)
+    fin.close()
+    for i in range(element * groupSize, min((element + 1) * groupSize, len(tasks))):
+        moduleName, funcName, args, kwargs = tasks[i]
+        try:
+            func = getattr(importlib.import_module(moduleName), funcName)
+            result = ("ok", func(*args, **kwargs))
+        except Exception:
+            result = ("error", traceback.format_exc())
+        resultFile = path.join(batchDir, "result_%i.pkl" % i)
+        fout = open(resultFile + ".tmp", "wb")
+        pickle.dump(result, fout)
+        fout.close()
+        # the executor never reads a half-written result
+        os.replace(resultFile + ".tmp", resultFile)
+
+
+if __name__ == '__main__':
+    run_tasks(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
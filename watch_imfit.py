@@ -0,0 +1,311 @@
+#! /usr/bin/env python
+
+""" Streaming mode: watches a directory for new images and fits every
+complete one as soon as it arrives.
+
+    ./watch_imfit.py incoming/ config.dat --model default.imfit --outdir stream
+
+An image gal.fits is fitted with the model gal.imfit (or the --model one),
+its PSF, mask and weight are taken from the gal_psf.fits, gal_mask.fits and
+gal_weight.fits sidecar files if they exist (the suffixes can be changed),
+otherwise from the config. Sidecars have to appear within --settle
+seconds after the image. Files are detected by inotify on Linux (when they
+are closed after writing or moved into the directory) and by polling
+elsewhere (or with --poll); a polled file is complete when its size and
+modification time stay the same in two more scans and for --settle
+seconds. Files present before the start are always polled. Results of the
+objects are appended to outdir/results.dat as they finish, throughput and
+queue latency are saved to outdir/metrics.json.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import json
+import os
+import select
+import struct
+import threading
+import time
+from os import path
+
+from libs.read_input import ImfitModel
+from fit_daemon import FitDaemon
+
+# inotify events of a file which is written completely
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0x00000800
+inotifyEventHeader = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """ inotify watch of a directory through libc (Linux only) """
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def read(self, timeout):
+        """ Waits up to 'timeout' seconds, returns the names of the files
+        written or moved into the directory """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        names = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = inotifyEventHeader.unpack_from(data, offset)
+            offset += inotifyEventHeader.size
+            names.append(data[offset:offset + length].rstrip(b"\0").decode())
+            offset += length
+        return names
+
+
+class ImageWatcher(object):
+    """ Finds complete new images in the directory. Sidecar files (the
+    ones with the PSF, mask or weight suffixes) are not images """
+    def __init__(self, directory, sidecarSuffixes, settle, usePolling=False):
+        self.directory = directory
+        self.sidecarSuffixes = sidecarSuffixes
+        self.settle = settle
+        self.seen = set()
+        # (size, mtime, time of the first observation, number of scans
+        # without changes) of growing files
+        self.growing = {}
+        self.inotify = None
+        # files to poll with inotify: the ones which were there before it
+        self.existing = None
+        if not usePolling:
+            try:
+                self.inotify = Inotify(directory)
+                self.existing = set(os.listdir(directory))
+            except (OSError, AttributeError, TypeError):
+                print("inotify is not available, polling %s" % directory)
+
+    def is_image(self, name):
+        if not name.endswith(".fits"):
+            return False
+        return not any(name[:-5].endswith(suffix) for suffix in self.sidecarSuffixes)
+
+    def scan(self, names=None):
+        """ Polls the directory (or the given names in it): returns the
+        images whose size and modification time did not change in two
+        scans after the first one and for 'settle' seconds """
+        complete = []
+        now = time.time()
+        if names is None:
+            names = os.listdir(self.directory)
+        for name in sorted(names):
+            if (name in self.seen) or not self.is_image(name):
+                continue
+            try:
+                stat = os.stat(path.join(self.directory, name))
+            except OSError:
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            if (name not in self.growing) or (self.growing[name][:2] != state):
+                self.growing[name] = state + (now, 0)
+                continue
+            size, mtime, firstSeen, stableScans = self.growing[name]
+            self.growing[name] = (size, mtime, firstSeen, stableScans + 1)
+            if (stableScans + 1 >= 2) and (now - firstSeen >= self.settle):
+                complete.append(name)
+        return complete
+
+    def wait(self, timeout):
+        """ Waits up to 'timeout' seconds for new complete images,
+        returns their paths """
+        if self.inotify is not None:
+            # a new file is complete when it is closed or moved in, so files
+            # being written are never taken; the ones present before the start
+            # of the watch are polled
+            names = [name for name in self.inotify.read(timeout) if self.is_image(name)]
+            names += self.scan(self.existing - self.seen)
+        else:
+            time.sleep(timeout)
+            names = self.scan()
+        newNames = []
+        for name in names:
+            if name not in self.seen:
+                self.seen.add(name)
+                self.growing.pop(name, None)
+                newNames.append(name)
+        return [path.join(self.directory, name) for name in newNames]
+
+
+class StreamFitter(object):
+    """ Queues the images as fit jobs of a FitDaemon, writes the
+    results and the metrics as the jobs finish """
+    def __init__(self, args):
+        self.args = args
+        self.daemon = FitDaemon(path.abspath(args.config), path.abspath(args.outdir), onFinish=self.finished)
+        self.startTime = time.time()
+        self.lock = threading.Lock()
+        # images waiting for their sidecar model: path -> time of detection
+        self.pending = {}
+        self.detected = {}
+        self.numDetected = 0
+        self.numSkipped = 0
+        self.latencies = []
+        self.fitTimes = []
+        self.counts = {"done": 0, "failed": 0, "cancelled": 0}
+        self.results = open(path.join(args.outdir, "results.dat"), "a", buffering=1)
+        self.results.write("# Stream %s started at %s\n" % (args.directory,
+                                                           datetime.datetime.now().strftime("%d.%m.%Y %H:%M")))
+        self.results.write("# name  state  chi2  generations  evaluations  latency(s)  time(s)\n")
+
+    def sidecar(self, image, suffix):
+        fileName = "%s%s.fits" % (image[:-5], suffix)
+        if path.exists(fileName):
+            return fileName
+        return None
+
+    def add(self, image):
+        self.numDetected += 1
+        self.pending[image] = time.time()
+
+    def submit_pending(self):
+        """ Submits the images whose model is found, skips the ones
+        which waited for it longer than sidecarWait. The images are
+        submitted 'settle' seconds after their detection at the earliest,
+        so that their sidecar files can arrive """
+        args = self.args
+        for image, detected in list(self.pending.items()):
+            if time.time() - detected < args.settle:
+                # sidecar files can be written after the image
+                continue
+            name = path.basename(image)[:-5]
+            model = image[:-5] + ".imfit"
+            if not path.exists(model):
+                if args.model is not None:
+                    model = path.abspath(args.model)
+                elif time.time() - detected < args.sidecarWait:
+                    continue
+                else:
+                    self.skip(image, "no model file")
+                    continue
+            try:
+                # a broken model fails here, not in the queue
+                ImfitModel(model, quiet=True)
+            except Exception as err:
+                self.skip(image, "bad model %s (%s)" % (model, err))
+                continue
+            overrides = {"fitsToFit": path.abspath(image)}
+            for key, suffix in (("PSF", args.psfSuffix), ("mask", args.maskSuffix),
+                                ("weight", args.weightSuffix)):
+                fileName = self.sidecar(image, suffix)
+                if fileName is not None:
+                    overrides[key] = path.abspath(fileName)
+            request = {"model": model, "overrides": overrides,
+                       "resultsDir": path.abspath(path.join(args.outdir, name, "results"))}
+            if args.cores is not None:
+                request["cores"] = args.cores
+            with self.lock:
+                # the job can finish before submit returns
+                try:
+                    ident = self.daemon.submit(request)
+                    self.detected[ident] = (name, detected)
+                    rejected = None
+                except ValueError as err:
+                    rejected = str(err)
+            if rejected is not None:
+                self.skip(image, "rejected by the daemon (%s)" % rejected)
+                continue
+            del self.pending[image]
+
+    def skip(self, image, reason):
+        print("%s skipped: %s" % (image, reason))
+        self.results.write("%s  skipped  nan  0  0  0.0  0.0\n" % path.basename(image)[:-5])
+        self.numSkipped += 1
+        del self.pending[image]
+
+    def finished(self, job):
+        """ Writes the result of the job (called by the daemon) """
+        with self.lock:
+            name, detected = self.detected.pop(job.ident)
+            latency = (job.started or job.finished) - detected
+            fitTime = job.finished - job.started if job.started is not None else 0.0
+            self.counts[job.state] += 1
+            if job.started is not None:
+                self.latencies.append(latency)
+                self.fitTimes.append(fitTime)
+            if job.result is not None:
+                self.results.write("%s  %s  %1.5f  %i  %i  %1.1f  %1.1f\n" % (name, job.state, job.result.chisq,
+                                                                           job.result.generations,
+                                                                           job.result.evaluations,
+                                                                           latency, fitTime))
+            else:
+                self.results.write("%s  %s  nan  0  0  %1.1f  %1.1f\n" % (name, job.state, latency, fitTime))
+        print("%s: %s" % (name, job.state))
+
+    def metrics(self):
+        """ Throughput and queue latency of the stream """
+        with self.lock:
+            hours = (time.time() - self.startTime) / 3600.0
+            states = [job.state for job in self.daemon.jobs.values()]
+            latencies = sorted(self.latencies)
+            data = {"updated": time.time(), "uptime": hours * 3600.0,
+                    "detected": self.numDetected, "waitingForSidecars": len(self.pending),
+                    "skipped": self.numSkipped, "queued": states.count("queued"),
+                    "running": states.count("running"), "done": self.counts["done"],
+                    "failed": self.counts["failed"], "cancelled": self.counts["cancelled"],
+                    "throughputPerHour": self.counts["done"] / hours if hours > 0 else 0.0}
+            if latencies:
+                data["queueLatencyMean"] = sum(latencies) / len(latencies)
+                data["queueLatencyMedian"] = latencies[len(latencies) // 2]
+                data["queueLatencyMax"] = latencies[-1]
+                data["fitTimeMean"] = sum(self.fitTimes) / len(self.fitTimes)
+        return data
+
+    def save_metrics(self):
+        fileName = path.join(self.args.outdir, "metrics.json")
+        fout = open(fileName + ".tmp", "w")
+        json.dump(self.metrics(), fout, indent=2)
+        fout.close()
+        # readers never see a half-written file
+        os.replace(fileName + ".tmp", fileName)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit new images arriving to a directory")
+    parser.add_argument("directory", help="Directory to watch")
+    parser.add_argument("config", help="Config file with parameters shared by all the objects")
+    parser.add_argument("--model", default=None, help="Model for the images without their own .imfit file")
+    parser.add_argument("--outdir", default="stream", help="Directory for the results")
+    parser.add_argument("--cores", type=int, default=None, help="Number of cores for every fit")
+    parser.add_argument("--psf-suffix", dest="psfSuffix", default="_psf", help="Suffix of the PSF sidecar files")
+    parser.add_argument("--mask-suffix", dest="maskSuffix", default="_mask", help="Suffix of the mask sidecar files")
+    parser.add_argument("--weight-suffix", dest="weightSuffix", default="_weight",
+                        help="Suffix of the weight sidecar files")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds without changes after which a polled file is complete")
+    parser.add_argument("--sidecar-wait", dest="sidecarWait", type=float, default=60.0,
+                        help="Seconds to wait for the model file of an image")
+    parser.add_argument("--period", type=float, default=1.0, help="Seconds between checks of the directory")
+    parser.add_argument("--poll", action="store_true", help="Poll the directory instead of using inotify")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+    watcher = ImageWatcher(args.directory, [args.psfSuffix, args.maskSuffix, args.weightSuffix],
+                           args.settle, usePolling=args.poll)
+    stream = StreamFitter(args)
+    print("Watching %s (%s)" % (args.directory, "polling" if watcher.inotify is None else "inotify"))
+    try:
+        while True:
+            for image in watcher.wait(args.period):
+                stream.add(image)
+            stream.submit_pending()
+            stream.save_metrics()
+    except KeyboardInterrupt:
+        pass
+    stream.daemon.shutdown()
+    stream.save_metrics()